@@ -20,10 +20,11 @@ import operator
 
 from fractions import Fraction as F
 from functools import reduce
-from sys import argv
+from sys import argv, exit, stdout
 
 from gate import Gate
-from path_runner import PathRunner
+from path_runner import EXACT, PathRunner, Ticks
+from vcd import VcdWriter
 
 
 def AND(inputs):
@@ -47,7 +48,13 @@ def NAND(inputs):
     return not all(inputs)
 
 
-if argv[1] == "idealized.tex":
+# The file extension chooses between drawing the figure as a TikZ picture
+# and writing its waveforms as a Value Change Dump.
+name, _, output_format = argv[1].rpartition(".")
+if output_format not in ("tex", "vcd"):
+    raise ValueError
+
+if name == "idealized":
     gates = [
         Gate([1, 2], True,  (1, 0, 0), OR, "P"),
         Gate([2],    False, (1, 0, 0), COPY, "Q"),
@@ -57,7 +64,7 @@ if argv[1] == "idealized.tex":
     height = F(4)
     padding = F(1, 5)
     end_time = F(40)
-elif argv[1] == "jagged.tex":
+elif name == "jagged":
     gates = [
         Gate([1, 2], True,  ("1.0", "1.01"), OR, "P"),
         Gate([2],    False, ("0.5", "1.01"), COPY, "Q"),
@@ -67,7 +74,7 @@ elif argv[1] == "jagged.tex":
     height = F(4)
     padding = F(1, 5)
     end_time = F(40)
-elif argv[1] == "flatline.tex":
+elif name == "flatline":
     gates = [
         Gate([1, 2], True,  ("1.0", "1.0208333333334"), OR, "P"),
         Gate([2],    False, ("0.5", "1.0208333333334"), COPY, "Q"),
@@ -77,7 +84,7 @@ elif argv[1] == "flatline.tex":
     height = F(4)
     padding = F(1, 5)
     end_time = F(40)
-elif argv[1] == "clocked.tex":
+elif name == "clocked":
     FLIP_FLOP_GATES = 7
     FLIP_FLOP_OUTPUT = 4
     def create_flip_flop(gates, clock, data, value, label):
@@ -115,8 +122,25 @@ else:
     raise ValueError
 
 
-runner = PathRunner(gates)
-runner.truncate_at(end_time)
+# An optional resolution simulates in fixed-point ticks of that size instead
+# of exactly, which is much faster but only approximates the exact figures.
+# The ticks have to be fine enough to split the threshold from 0 and 1 and
+# to give every gate some lag time.
+if len(argv) > 2:
+    try:
+        numbers = Ticks(int(argv[2]))
+    except ValueError:
+        exit("The resolution must be a whole number of at least 2.")
+    if any(numbers.number(gate.lag_time) <= 0 for gate in gates):
+        exit("The resolution is too coarse for the lag times in %s." % argv[1])
+else:
+    numbers = EXACT
+
+if output_format == "vcd":
+    runner = PathRunner(gates, numbers, VcdWriter(stdout, gates, numbers))
+    runner.truncate_at(end_time)
+    runner.close()
+    exit()
 
 paths_to_display = []
 path_names = []
@@ -126,8 +150,18 @@ for i in range(0, len(gates)):
         paths_to_display.append(i)
         path_names.append(gate.label)
 
+# The paths are streamed out of the runner, keeping just the displayed ones.
+paths = {g: [] for g in paths_to_display}
+def collect(time, chunks, values):
+    for g in paths:
+        paths[g].extend(chunks[g])
+
+runner = PathRunner(gates, numbers, collect)
+runner.truncate_at(end_time)
+
 size = len(paths_to_display)
 time = runner.get_time()
+runner.close()
 
 path_width = width - 2 * padding
 path_height = (height - padding) / size - padding
@@ -142,7 +176,7 @@ for i in range(0, size):
             % (padding, path_middle, path_names[i],
                padding + path_width, path_middle))
 
-    path = runner.get_path(paths_to_display[i])
+    path = paths[paths_to_display[i]]
     for p in range(0, len(path)):
         point_t, point_v = path[p]
         x = point_t * path_width / time + padding
@@ -14,159 +14,316 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import heapq
+
+from array import array
+from bisect import bisect_right
 from fractions import Fraction as F
 
 
-ONE = F(1)
-ZERO = F(0)
-ONE_HALF = F(1, 2)
+class Numbers:
+    """The arithmetic used for times and values, along with the threshold
+       test that turns a path into boolean values."""
+
+    def __init__(self):
+        self.one_half = self.number(F(1, 2))
+
+    def classify_segment(self, start_t, start_v, end_t, end_v):
+        """Returns (start_b, end_b, t) where the path segment from (start_t,
+           start_v) to (end_t, end_v) starts with boolean value start_b and
+           ends with end_b, crossing the threshold between them at time t if
+           they differ (and otherwise t is None)."""
+        one_half = self.one_half
+        assert start_v != one_half or end_v != one_half
+        transition_time = None
+        if start_v >= one_half and end_v >= one_half:
+            start_b = True
+            end_b = True
+        elif start_v <= one_half and end_v <= one_half:
+            start_b = False
+            end_b = False
+        elif start_v > one_half and end_v < one_half:
+            start_b = True
+            end_b = False
+            fall_delta = start_v - end_v
+            transition_delta = start_v - one_half
+            fall_time = end_t - start_t
+            transition_time = self.snap(start_t +
+                    transition_delta / fall_delta * fall_time)
+        else:  # start_v < one_half and end_v > one_half
+            start_b = False
+            end_b = True
+            rise_delta = end_v - start_v
+            transition_delta = one_half - start_v
+            rise_time = end_t - start_t
+            transition_time = self.snap(start_t +
+                    transition_delta / rise_delta * rise_time)
+        return start_b, end_b, transition_time
+
+
+class Exact(Numbers):
+    """Exact rational arithmetic, as used for the thesis figures. The
+       denominators keep growing as the simulation runs, so each step gets
+       slower than the last."""
+
+    def number(self, x):
+        return F(x)
+
+    def snap(self, x):
+        return x
+
+    def sequence(self, items):
+        return list(items)
+
+
+class Ticks(Numbers):
+    """Floating-point arithmetic with every computed time and value rounded
+       to a whole number of ticks of 1/resolution, so that each step takes
+       constant time and results that would be equal exactly still compare
+       equal. Sums and differences of ticks are rounded as well, since they
+       are only exact with a power of two resolution."""
+
+    def __init__(self, resolution=2**20):
+        # The threshold has to fall strictly between 0 and 1.
+        if resolution < 2:
+            raise ValueError("the resolution must be at least 2")
+        self.resolution = resolution
+        super().__init__()
+
+    def number(self, x):
+        return self.snap(float(F(x)))
+
+    def snap(self, x):
+        return round(x * self.resolution) / self.resolution
+
+    def sequence(self, items):
+        return array("d", items)
+
+
+EXACT = Exact()
+
+# The fewest points each path holds on average before the paths are next
+# flushed to a consumer.
+FLUSH_SIZE = 64
 
 
 class PathRunner:
 
-    def __init__(self, gates):
+    def __init__(self, gates, numbers=EXACT, consumer=None):
+        """Simulates the given gates using the given numeric backend. If a
+           consumer is given, the points that no gate can read anymore,
+           being older than the longest lag time, are passed to it and then
+           dropped, so that a long simulation runs in bounded memory. It is
+           called as consumer(time, chunks, values), where chunks[g] is a
+           list of the (t, v) points of gate g's path up to time that
+           weren't passed before, and values[g] is the path's value at
+           time. The last point of each chunk is kept, being the start of
+           the segment containing time, but isn't passed again. The rest
+           are passed on by close()."""
         self.gates = gates
-        self.paths = []
-        for gate in gates:
-            path = []
-            initial_value = ONE if gate.initial_value else ZERO
-            lag_time = gate.lag_time
-            path.append((ZERO, initial_value))
-            path.append((lag_time, initial_value))
-            self.paths.append(path)
+        self.numbers = numbers
+        self.consumer = consumer
+        self.one = numbers.number(1)
+        self.zero = numbers.number(0)
+        self.one_half = numbers.one_half
+        self.timings = [
+            (numbers.number(gate.lag_time), numbers.number(gate.rise_time),
+             numbers.number(gate.fall_time))
+            for gate in gates
+        ]
+        # A lag time that rounds to nothing would never let the gate's path
+        # advance.
+        if any(lag_time <= 0 for lag_time, _, _ in self.timings):
+            raise ValueError("lag times must be at least one tick")
+        # Each path is kept as parallel sequences of the times and values
+        # of its points, which the Ticks backend stores as compact arrays.
+        self.times = []
+        self.values = []
+        for gate, (lag_time, _, _) in zip(gates, self.timings):
+            initial_value = self.one if gate.initial_value else self.zero
+            self.times.append(numbers.sequence([self.zero, lag_time]))
+            self.values.append(numbers.sequence([initial_value, initial_value]))
+        self.max_lag = max((lag_time for lag_time, _, _ in self.timings),
+                           default=self.zero)
+        self.passed = [0] * len(gates)
+        self.held = 2 * len(gates)
+        self.flush_size = FLUSH_SIZE * len(gates)
+        self.schedule()
+
+    def schedule(self):
+        """Queues every gate to be stepped at the end of its path. Only
+           stepping a gate extends its path, so after that each gate just
+           has to be queued again as it is stepped."""
+        self.queue = [(times[-1], g) for g, times in enumerate(self.times)]
+        heapq.heapify(self.queue)
 
     def truncate_at(self, time):
-        if any(gate.lag_time > time for gate in self.gates):
+        time = self.numbers.number(time)
+        if any(lag_time > time for lag_time, _, _ in self.timings):
             raise ValueError
         while self.get_time() < time:
             self.step()
-        for path in self.paths:
-            for i in range(len(path) - 1, 0, -1):
-                start_t, start_v = path[i - 1]
-                end_t, end_v = path[i]
+        for times, values in zip(self.times, self.values):
+            for i in range(len(times) - 1, 0, -1):
+                start_t, start_v = times[i - 1], values[i - 1]
+                end_t, end_v = times[i], values[i]
                 if start_t >= time:
-                    del path[i]
+                    del times[i]
+                    del values[i]
                 elif end_t == time:
                     break
                 else:
                     assert end_t > time
-                    path[i] = (time, start_v + (end_v - start_v)
+                    times[i] = time
+                    values[i] = self.numbers.snap(start_v + (end_v - start_v)
                                      * (time - start_t) / (end_t - start_t))
                     break
+        self.schedule()
+
+    def flush(self, horizon):
+        """Passes the points of every path up to the given time to the
+           consumer, and drops those before the segment containing it. The
+           paths then aren't flushed again until they have doubled in
+           size."""
+        chunks = []
+        levels = []
+        for g, (times, values) in enumerate(zip(self.times, self.values)):
+            i = bisect_right(times, horizon) - 1
+            start_t, start_v = times[i], values[i]
+            end_t, end_v = times[i + 1], values[i + 1]
+            levels.append(self.numbers.snap(start_v + (end_v - start_v)
+                                            * (horizon - start_t) / (end_t - start_t)))
+            chunks.append(list(zip(times[self.passed[g]:i + 1],
+                                   values[self.passed[g]:i + 1])))
+            del times[:i]
+            del values[:i]
+            self.passed[g] = 1
+        self.consumer(horizon, chunks, levels)
+        self.held = sum(len(times) for times in self.times)
+        self.flush_size = max(2 * self.held, FLUSH_SIZE * len(self.gates))
+
+    def close(self):
+        """Passes all of the points still held to the consumer, as of the
+           end of the longest path, ending the simulation."""
+        time = max(times[-1] for times in self.times)
+        chunks = [self.get_path(g)[self.passed[g]:]
+                  for g in range(0, len(self.gates))]
+        self.consumer(time, chunks, [values[-1] for values in self.values])
+        for times, values in zip(self.times, self.values):
+            del times[:]
+            del values[:]
 
     def get_size(self):
         return len(self.gates)
 
     def get_path(self, g):
-        return self.paths[g]
+        """Returns the points of gate g's path, or just those not yet passed
+           to the consumer if there is one."""
+        return list(zip(self.times[g], self.values[g]))
 
     def get_time(self):
-        return min(path[-1][0] for path in self.paths)
+        return self.queue[0][0]
 
     def step(self):
+        # The queue is ordered by gate within the same time, so the gates
+        # are stepped in the same order as if they were all scanned.
         time = self.get_time()
-        for g in range(0, len(self.gates)):
-            gate = self.gates[g]
-            path = self.paths[g]
-            last_t, last_v = path[-1]
-            if last_t == time:
-                output_t, output_v = self.compute_output_segment(gate, time)
-                current_value = last_v
-                target_value = output_v
-                assert target_value == 0 or target_value == 1
-                if target_value == current_value:
-                    self.add_points(g, [(output_t, output_v)])
-                elif target_value == 0:
-                    end_value = None if gate.fall_time == 0 else \
-                            current_value - (output_t - time) / gate.fall_time
-                    if end_value is not None and end_value >= 0:
-                        self.add_points(g, [(output_t, end_value)])
-                    else:
-                        cross_time = current_value * gate.fall_time
-                        self.add_points(g, [(time + cross_time, ZERO),
-                                (output_t, output_v)]);
-                else:  # target_value == 1
-                    end_value = None if gate.rise_time == 0 else \
-                            current_value + (output_t - time) / gate.rise_time
-                    if end_value is not None and end_value <= 1:
-                        self.add_points(g, [(output_t, end_value)])
-                    else:
-                        cross_time = (ONE - current_value) * gate.rise_time
-                        self.add_points(g, [(time + cross_time, ONE),
-                                (output_t, output_v)])
+        while self.queue and self.queue[0][0] == time:
+            _, g = heapq.heappop(self.queue)
+            _, rise_time, fall_time = self.timings[g]
+            self.held -= len(self.times[g])
+            last_v = self.values[g][-1]
+            output_t, output_v = self.compute_output_segment(g, time)
+            current_value = last_v
+            target_value = output_v
+            assert target_value == 0 or target_value == 1
+            if target_value == current_value:
+                self.add_points(g, [(output_t, output_v)])
+            elif target_value == 0:
+                end_value = None if fall_time == 0 else self.numbers.snap(
+                        current_value - (output_t - time) / fall_time)
+                if end_value is not None and end_value >= 0:
+                    self.add_points(g, [(output_t, end_value)])
+                else:
+                    cross_time = self.numbers.snap(current_value * fall_time)
+                    cross_t = self.numbers.snap(time + cross_time)
+                    self.add_points(g, [(cross_t, self.zero),
+                            (output_t, output_v)]);
+            else:  # target_value == 1
+                end_value = None if rise_time == 0 else self.numbers.snap(
+                        current_value + (output_t - time) / rise_time)
+                if end_value is not None and end_value <= 1:
+                    self.add_points(g, [(output_t, end_value)])
+                else:
+                    cross_time = self.numbers.snap((self.one - current_value) * rise_time)
+                    cross_t = self.numbers.snap(time + cross_time)
+                    self.add_points(g, [(cross_t, self.one),
+                            (output_t, output_v)])
+            heapq.heappush(self.queue, (self.times[g][-1], g))
+            self.held += len(self.times[g])
+        if self.consumer is not None and self.held >= self.flush_size \
+                and time > self.max_lag:
+            self.flush(self.numbers.snap(time - self.max_lag))
 
     def add_points(self, g, points):
-        path = self.paths[g]
-        prior_t, prior_v = path[-1]
+        times = self.times[g]
+        values = self.values[g]
+        prior_t, prior_v = times[-1], values[-1]
         assert points[-1][0] > prior_t
         for point_t, point_v in points:
             assert point_t >= prior_t and 0 <= point_v <= 1
             prior_t, prior_v = point_t, point_v
         for point_t, point_v in points:
-            prior_t, prior_v = path[-1]
-            earlier_v = path[-2][1] if len(path) > 1 else None
+            prior_t, prior_v = times[-1], values[-1]
+            earlier_v = values[-2] if len(values) > 1 else None
             if earlier_v is not None and (
                     point_v == prior_v and prior_v == earlier_v
                     or point_v > prior_v and prior_v > earlier_v
                     or point_v < prior_v and prior_v < earlier_v):
-                path[-1] = (point_t, point_v)
+                times[-1] = point_t
+                values[-1] = point_v
             elif point_t != prior_t or point_v != prior_v:
-                path.append((point_t, point_v))
+                times.append(point_t)
+                values.append(point_v)
 
-    def compute_output_segment(self, gate, time):
-        """Returns (t, v) where the inputs provide a consistent input
-           from time to t with target value v."""
-        t0 = time - gate.lag_time
+    def compute_output_segment(self, g, time):
+        """Returns (t, v) where the inputs of gate g provide a consistent
+           input from time to t with target value v."""
+        gate = self.gates[g]
+        lag_time = self.timings[g][0]
+        t0 = self.numbers.snap(time - lag_time)
         input_segments = [self.compute_input_segment(input, t0)
                           for input in gate.inputs]
         output_b = gate.function([b for t, b in input_segments])
-        return (min(t for t, v in input_segments) + gate.lag_time,
-                ONE if output_b else ZERO)
+        return (self.numbers.snap(min(t for t, v in input_segments) + lag_time),
+                self.one if output_b else self.zero)
 
     def compute_input_segment(self, g, t0):
         """Returns (t, b) where gate g provides a consistent output
            from time t0 to t with boolean value b."""
         t = t0
         b = None
-        path = self.paths[g]
+        times = self.times[g]
+        values = self.values[g]
 
-        # optimize for large paths, since we only need the last few segments
-        first_index = -1
-        for i in range(len(path) - 1, 0, -1):
-            if path[i][0] > t0:
-                first_index = i - 1
-            else:
-                break
-        assert 0 <= first_index <= len(path) - 2
-
-        for i in range(first_index, len(path) - 1):
-            start_t, start_v = path[i]
-            end_t, end_v = path[i + 1]
-            assert start_v != ONE_HALF or end_v != ONE_HALF
-            transition_time = None
-            if start_v >= ONE_HALF and end_v >= ONE_HALF:
-                start_b = True
-                end_b = True
-            elif start_v <= ONE_HALF and end_v <= ONE_HALF:
-                start_b = False
-                end_b = False
-            elif start_v > ONE_HALF and end_v < ONE_HALF:
-                start_b = True
-                end_b = False
-                fall_delta = start_v - end_v
-                transition_delta = start_v - ONE_HALF
-                fall_time = end_t - start_t
-                transition_time = start_t + \
-                        transition_delta / fall_delta * fall_time
-            else:  # start_v < ONE_HALF and end_v > ONE_HALF
-                start_b = False
-                end_b = True
-                rise_delta = end_v - start_v
-                transition_delta = ONE_HALF - start_v
-                rise_time = end_t - start_t
-                transition_time = start_t + \
-                        transition_delta / rise_delta * rise_time
+        # find the segment containing t0 by galloping back from the end and
+        # then bisecting, since t0 is usually within the last few segments
+        hi = len(times)
+        lo = hi - 1
+        stride = 1
+        while lo > 0 and times[lo] > t0:
+            stride *= 2
+            lo, hi = max(lo - stride, 0), lo
+        if hi - lo > 1:
+            lo = max(bisect_right(times, t0, lo, hi), 1) - 1
+        first_index = lo
+        assert 0 <= first_index <= len(times) - 2
 
+        for i in range(first_index, len(times) - 1):
+            start_b, end_b, transition_time = self.numbers.classify_segment(
+                    times[i], values[i], times[i + 1], values[i + 1])
+            start_t = times[i]
+            end_t = times[i + 1]
             if transition_time is not None and t0 >= transition_time:
                 b = end_b;
                 t = end_t;
@@ -21,7 +21,7 @@ from fractions import Fraction as F
 from functools import reduce
 
 from gate import Gate
-from path_runner import PathRunner
+from path_runner import FLUSH_SIZE, PathRunner, Ticks
 
 
 def COPY(inputs):
@@ -276,6 +276,22 @@ class PathRunnerTestCase(unittest.TestCase):
         self.assertPath(1, 0.0, 0.0,                     2.0, 0.0, 2.0, 1.0, 3.0, 1.0, 3.0, 0.0, 5.0, 0.0, 5.0, 1.0, 6.0, 1.0)
         self.assertPath(2, 0.0, 0.0, 1.0, 0.0, 1.0, 1.0, 2.0, 1.0, 2.0, 0.0, 4.0, 0.0, 4.0, 1.0, 5.0, 1.0, 5.0, 0.0, 6.0, 0.0)
 
+    def test_stepOnlyAdvancesGatesAtCurrentTime(self):
+        fast = Gate([0], True, (1, 0, 0), NOT)
+        slow = Gate([1], True, (10, 0, 0), NOT)
+        self.runner = PathRunner([fast, slow])
+
+        self.doSteps(9)
+
+        self.assertPath(0, 0.0, 1.0, 1.0, 1.0, 1.0, 0.0, 2.0, 0.0, 2.0, 1.0, 3.0, 1.0, 3.0, 0.0, 4.0, 0.0, 4.0, 1.0, 5.0, 1.0, 5.0, 0.0, 6.0, 0.0, 6.0, 1.0, 7.0, 1.0, 7.0, 0.0, 8.0, 0.0, 8.0, 1.0, 9.0, 1.0, 9.0, 0.0, 10.0, 0.0)
+        self.assertPath(1, 0.0, 1.0, 10.0, 1.0)
+        self.assertTime(10.0)
+
+        self.doSteps(1)
+
+        self.assertPath(1, 0.0, 1.0, 10.0, 1.0, 10.0, 0.0, 20.0, 0.0)
+        self.assertTime(11.0)
+
     def test_simpleTruncation(self):
         self.runner.truncate_at(F(3.5))
 
@@ -319,6 +335,110 @@ class PathRunnerTestCase(unittest.TestCase):
         self.runner.truncate_at(F(20.0))
         self.assertTime(20.0)
 
+    def test_longLagLooksFarBackAlongInputPath(self):
+        x = Gate([0], True, (F(1, 4), 0, 0), NOT)
+        y = Gate([0], True, (10, 0, 0), COPY)
+        self.runner = PathRunner([x, y])
+
+        self.runner.truncate_at(F(20))
+
+        delayed = [(t + 10, v) for t, v in self.runner.get_path(0)
+                   if t + 10 <= 20]
+        path = self.runner.get_path(1)
+        self.assertEqual(len(path), 80)
+        self.assertEqual(path[1:], delayed[1:len(path)])
+        self.assertTime(20.0)
+
+    def test_ticksMatchExactForDyadicTimings(self):
+        exact = self.runner
+        exact.truncate_at(F(20.0))
+        p = Gate([1, 2], True, (1.5, 1, 1), OR)
+        q = Gate([2], False, (.5, 1, 1), COPY)
+        r = Gate([0, 1], False, (2.5, 1, 1), XOR)
+        self.runner = PathRunner([p, q, r], Ticks())
+
+        self.runner.truncate_at(20)
+
+        for g in range(0, 3):
+            self.assertEqual(self.runner.get_path(g), exact.get_path(g))
+            self.assertTrue(all(type(t) is float and type(v) is float
+                                for t, v in self.runner.get_path(g)))
+        self.assertTime(20.0)
+
+    def test_ticksRoundToResolution(self):
+        x = Gate([0], True, (F(1, 3), F(1, 3), F(1, 3)), NOT)
+        self.runner = PathRunner([x], Ticks(4))
+
+        self.runner.truncate_at(2)
+
+        self.assertPath(0, 0.0, 1.0, 0.25, 1.0, 0.5, 0.0, 0.75, 0.0, 1.0, 1.0, 1.25, 1.0, 1.5, 0.0, 1.75, 0.0, 2.0, 1.0)
+        self.assertTime(2.0)
+
+    def test_ticksStayOnGridForDecimalResolutions(self):
+        for resolution in (1000, 100, 10, 7):
+            p = Gate([1, 2], True, ("1.0", "1.01"), OR)
+            q = Gate([2], False, ("0.5", "1.01"), COPY)
+            r = Gate([0, 1], False, ("1.5", "1.01"), XOR)
+            self.runner = PathRunner([p, q, r], Ticks(resolution))
+
+            self.runner.truncate_at(240)
+
+            for g in range(0, 3):
+                for t, v in self.runner.get_path(g):
+                    self.assertEqual(t, round(t * resolution) / resolution)
+                    self.assertEqual(v, round(v * resolution) / resolution)
+            self.assertTime(240.0)
+
+    def test_ticksRejectTooCoarseResolutions(self):
+        x = Gate([0], True, (F(1, 10), 0, 0), NOT)
+        self.assertRaises(ValueError, Ticks, 1)
+        self.assertRaises(ValueError, PathRunner, [x], Ticks(2))
+
+    def test_streamedPathsMatchHeldPaths(self):
+        # Long enough to flush several times before closing, so that the
+        # trimmed paths are truncated and stepped after a flush.
+        held = self.runner
+        held.truncate_at(F(400))
+        streamed = [[], [], []]
+        calls = []
+        p = Gate([1, 2], True, (1.5, 1, 1), OR)
+        q = Gate([2], False, (.5, 1, 1), COPY)
+        r = Gate([0, 1], False, (2.5, 1, 1), XOR)
+        def consumer(time, chunks, values):
+            calls.append(time)
+            for g in range(0, 3):
+                streamed[g].extend(chunks[g])
+        self.runner = PathRunner([p, q, r], consumer=consumer)
+
+        self.runner.truncate_at(F(200))
+        self.runner.truncate_at(F(400))
+        self.assertTime(400.0)
+        self.assertGreater(len(calls), 2)
+        self.runner.close()
+
+        for g in range(0, 3):
+            self.assertEqual(streamed[g], held.get_path(g))
+            self.assertEqual(self.runner.get_path(g), [])
+
+    def test_streamingKeepsBoundedHistory(self):
+        x = Gate([0], True, (1, 0, 0), NOT)
+        y = Gate([0], False, (F(5, 2), 0, 0), COPY)
+        counts = [0, 0]
+        def consumer(time, chunks, values):
+            for g in range(0, 2):
+                counts[g] += len(chunks[g])
+        self.runner = PathRunner([x, y], Ticks(), consumer)
+
+        longest = 0
+        while self.runner.get_time() < 2000:
+            self.runner.step()
+            longest = max(longest, *(len(self.runner.get_path(g))
+                                     for g in range(0, 2)))
+        self.runner.close()
+
+        self.assertLessEqual(longest, 2 * FLUSH_SIZE)
+        self.assertGreaterEqual(counts[0], 2 * 2000)
+
     def doSteps(self, steps):
         for step in range(0, steps):
             self.runner.step()
@@ -0,0 +1,106 @@
+# Justin's IIT Thesis - Digital Circuit Simulator
+# Copyright 2022-2023 by Justin T. Sampson
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import io
+import operator
+import unittest
+
+from fractions import Fraction as F
+from functools import reduce
+
+from gate import Gate
+from path_runner import PathRunner
+from vcd import VcdWriter, identifier
+
+
+def COPY(inputs):
+    assert len(inputs) == 1
+    return inputs[0]
+
+def NOT(inputs):
+    assert len(inputs) == 1
+    return not inputs[0]
+
+def OR(inputs):
+    return any(inputs)
+
+def XOR(inputs):
+    return reduce(operator.xor, inputs, False)
+
+
+class VcdWriterTestCase(unittest.TestCase):
+
+    def test_identifiers(self):
+        self.assertEqual(identifier(0), "!")
+        self.assertEqual(identifier(93), "~")
+        self.assertEqual(identifier(94), "!!")
+        codes = [identifier(g) for g in range(0, 10000)]
+        self.assertEqual(len(set(codes)), len(codes))
+        self.assertTrue(all(33 <= ord(c) <= 126 for code in codes for c in code))
+
+    def test_thresholdCrossings(self):
+        x = Gate([0], True, (1, 1, 1), NOT, "x")
+        y = Gate([0], False, (F(1, 2), 0, 0), COPY)
+
+        self.assertEqual(self.write([x, y], 4), """\
+$timescale 1ps $end
+$scope module circ $end
+$var wire 1 ! x $end
+$var wire 1 " g1 $end
+$upscope $end
+$enddefinitions $end
+#0
+$dumpvars
+1!
+0"
+$end
+#500
+1"
+#1500
+0!
+#2000
+0"
+#3000
+1!
+#3500
+1"
+""")
+
+    def test_streamedMatchesHeld(self):
+        p = Gate([1, 2], True, (1.5, 1, 1), OR)
+        q = Gate([2], False, (.5, 1, 1), COPY)
+        r = Gate([0, 1], False, (2.5, 1, 1), XOR)
+        runner = PathRunner([p, q, r])
+        runner.truncate_at(F(300))
+        held = io.StringIO()
+        runner.consumer = VcdWriter(held, [p, q, r])
+        runner.close()
+
+        streamed = self.write([p, q, r], 300)
+
+        self.assertEqual(streamed, held.getvalue())
+        self.assertGreater(len(streamed.splitlines()), 300)
+
+    def write(self, gates, time):
+        file = io.StringIO()
+        runner = PathRunner(gates, consumer=VcdWriter(file, gates))
+        runner.truncate_at(F(time))
+        runner.close()
+        return file.getvalue()
+
+
+if __name__ == '__main__':
+    unittest.main()
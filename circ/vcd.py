@@ -0,0 +1,91 @@
+# Justin's IIT Thesis - Digital Circuit Simulator
+# Copyright 2022-2023 by Justin T. Sampson
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from path_runner import EXACT
+
+
+def identifier(g):
+    """Returns the VCD identifier code for gate g, made of the printable
+       ASCII characters."""
+    code = chr(33 + g % 94)
+    while g >= 94:
+        g = g // 94 - 1
+        code += chr(33 + g % 94)
+    return code
+
+
+class VcdWriter:
+
+    def __init__(self, file, gates, numbers=EXACT, resolution=1000):
+        """Writes the given gates to the given file as a Value Change Dump,
+           where each gate changes value when its path crosses the
+           threshold of the given numeric backend, as read by the gates'
+           inputs. One unit of simulated time is resolution picoseconds,
+           i.e. one nanosecond by default. The writer is meant to be the
+           consumer of a PathRunner simulating the same gates with the same
+           backend, and the file is written as the runner passes it
+           points."""
+        self.file = file
+        self.numbers = numbers
+        self.resolution = resolution
+        self.last = []
+        self.state = []
+        self.written_time = 0
+        file.write("$timescale 1ps $end\n")
+        file.write("$scope module circ $end\n")
+        for g in range(0, len(gates)):
+            label = gates[g].label
+            file.write("$var wire 1 %s %s $end\n"
+                       % (identifier(g), "g%d" % g if label is None else label))
+        file.write("$upscope $end\n")
+        file.write("$enddefinitions $end\n")
+        file.write("#0\n")
+        file.write("$dumpvars\n")
+        for g in range(0, len(gates)):
+            self.last.append((numbers.number(0), numbers.number(
+                1 if gates[g].initial_value else 0)))
+            self.state.append(gates[g].initial_value)
+            file.write("%d%s\n" % (self.state[g], identifier(g)))
+        file.write("$end\n")
+
+    def __call__(self, time, chunks, values):
+        events = []
+        for g in range(0, len(chunks)):
+            for point in chunks[g]:
+                self.add_segment(events, g, self.last[g], point)
+                self.last[g] = point
+            # The path is only known up to the given time, so a change
+            # between that and the next point is written now and then not
+            # again.
+            if time > self.last[g][0]:
+                self.add_segment(events, g, self.last[g], (time, values[g]))
+        events.sort()
+        for t, g, b in events:
+            tick = max(round(t * self.resolution), self.written_time)
+            if tick != self.written_time:
+                self.file.write("#%d\n" % tick)
+                self.written_time = tick
+            self.file.write("%d%s\n" % (b, identifier(g)))
+
+    def add_segment(self, events, g, start, end):
+        start_t, start_v = start
+        end_t, end_v = end
+        start_b, end_b, transition_time = self.numbers.classify_segment(
+                start_t, start_v, end_t, end_v)
+        if end_b != self.state[g]:
+            events.append((start_t if transition_time is None
+                           else transition_time, g, end_b))
+            self.state[g] = end_b
@@ -0,0 +1,113 @@
+# Justin's IIT Thesis - Persistent Phi Store
+# Copyright 2022-2023 by Justin T. Sampson
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Phi values are stored in an SQLite database shared by run.py and
+# snap/snap.py, keyed by a hash of the network and PyPhi configuration plus
+# the state, so that a value computed once by either tool is never computed
+# again. SQLite's write-ahead log lets any number of processes read and write
+# the store at once.
+
+import hashlib
+import json
+import numbers
+import numpy
+import os
+import pyphi
+import sqlite3
+
+STORE_VERSION = 1
+STORE_NAME = "phi.sqlite"
+
+# Configuration settings that can't change a phi value, which are left out
+# of the key so that they don't keep results from being shared.
+IRRELEVANT_CONFIG = (
+    "CACHE_", "DATABASE", "LOG_", "MAXIMUM_CACHE_MEMORY", "NUMBER_OF_CORES",
+    "PARALLEL_", "PROGRESS_BARS", "REDIS_", "WELCOME_OFF",
+)
+
+
+def default_path():
+    return os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+        "iit-thesis",
+        STORE_NAME,
+    )
+
+
+def network_key(tpm, cm=None):
+    """Returns a hex digest identifying the network with the given TPM, in
+       state-by-node form, and connectivity matrix (defaulting to all ones
+       as in PyPhi) under the current PyPhi configuration."""
+    tpm = numpy.asarray(tpm, dtype="<f8")
+    nodes = tpm.shape[-1]
+    tpm = tpm.reshape(-1, nodes)
+    cm = numpy.ones((nodes, nodes)) if cm is None else numpy.asarray(cm)
+    config = {
+        name: value
+        for name, value in pyphi.config.snapshot().items()
+        if not name.startswith(IRRELEVANT_CONFIG)
+    }
+    key = hashlib.sha256()
+    key.update(json.dumps([STORE_VERSION, tpm.shape, config], sort_keys=True, default=str).encode())
+    key.update(numpy.ascontiguousarray(tpm).tobytes())
+    key.update(numpy.ascontiguousarray(cm, dtype=numpy.uint8).tobytes())
+    return key.hexdigest()
+
+
+def to_stored(phi):
+    """Returns the given phi value as a plain int or float (or None), which
+       is what SQLite can store, keeping ints as ints."""
+    if phi is None:
+        return None
+    if isinstance(phi, numbers.Integral):
+        return int(phi)
+    return float(phi)
+
+
+class PhiStore:
+    def __init__(self, path=None):
+        """Opens the store at the given path, or else the default one in the
+           same cache directory as run.py uses. A connection can't be shared
+           between processes, so each worker has to open its own."""
+        path = path or default_path()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # The phi column has no type, so that SQLite keeps each value as it
+        # was given: PyPhi gives an int 0 for a reducible state and a float
+        # otherwise, and a stored value has to print the same as a fresh one.
+        # The first version of the store kept every value as a float, in a
+        # table that's now ignored.
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS phi_values ("
+            "network TEXT, state TEXT, phi, PRIMARY KEY (network, state))"
+        )
+
+    def get(self, network, state):
+        """Returns (True, phi) if the phi value of the given state of the
+           network with the given key is stored, where phi is None for an
+           unreachable state, and otherwise (False, None)."""
+        row = self.connection.execute(
+            "SELECT phi FROM phi_values WHERE network = ? AND state = ?",
+            (network, "".join(str(int(s)) for s in state)),
+        ).fetchone()
+        return (False, None) if row is None else (True, row[0])
+
+    def put(self, network, state, phi):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO phi_values VALUES (?, ?, ?)",
+            (network, "".join(str(int(s)) for s in state), to_stored(phi)),
+        )
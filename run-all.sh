@@ -10,9 +10,9 @@ for prog in pqr counter pqrpqr optimized unrolled; do
     echo "============================"
     echo "$prog - analysis"
     echo "----------------------------"
-    docker run -it --rm --pull never iit-thesis $prog.txt phi
+    docker run -it --rm --pull never -v iit-thesis-cache:/root/.cache iit-thesis $prog.txt phi
     echo "============================"
     echo "$prog - causal model"
     echo "----------------------------"
-    docker run -it --rm --pull never iit-thesis $prog.txt micro
+    docker run -it --rm --pull never -v iit-thesis-cache:/root/.cache iit-thesis $prog.txt micro
 done
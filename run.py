@@ -16,25 +16,108 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import hashlib
 import json
+import mmap
+import multiprocessing
+import os
 import random
 import re
+import signal
+import stat
+import struct
 import sys
+import tempfile
 import time
 
+from array import array
+from collections import deque
+from contextlib import nullcontext
 from dataclasses import dataclass
+from itertools import combinations, islice, product, zip_longest
 from typing import Generator
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 if len(sys.argv) < 2:
     sys.exit("No program file name given.")
 
 program_file = sys.stdin if sys.argv[1] == "-" else open(sys.argv[1])
 
+
+def pop_option(name, default=None):
+    """Removes "<name> <value>" from the command line if present, returning
+       the value or else the given default."""
+    if name not in sys.argv[2:]:
+        return default
+    index = sys.argv.index(name, 2)
+    if index + 1 >= len(sys.argv):
+        sys.exit(f"Option {name} requires a value.")
+    value = sys.argv[index + 1]
+    del sys.argv[index:index + 2]
+    return value
+
+
+engine = pop_option("--engine", "numpy" if numpy is not None else "python")
+if engine not in ("python", "numpy", "symbolic"):
+    sys.exit(f"Engine must be 'python', 'numpy' or 'symbolic', not '{engine}'.")
+if engine == "numpy" and numpy is None:
+    sys.exit("The numpy engine requires NumPy to be installed.")
+
+jobs = pop_option("--jobs", "1")
+if not re.fullmatch("[1-9][0-9]*", jobs):
+    sys.exit(f"Number of jobs must be a positive integer, not '{jobs}'.")
+jobs = int(jobs)
+
+prep_format = pop_option("--format", "json")
+if prep_format not in ("json", "bin"):
+    sys.exit(f"Format must be 'json' or 'bin', not '{prep_format}'.")
+
+cache_dir = pop_option("--cache", os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "iit-thesis"
+))
+if cache_dir == "off":
+    cache_dir = None
+
+journal_file = pop_option("--journal")
+
+time_budget = pop_option("--time-budget")
+if time_budget is not None:
+    if not re.fullmatch("[0-9]+(\\.[0-9]*)?", time_budget):
+        sys.exit(f"Time budget must be a number of seconds, not '{time_budget}'.")
+    time_budget = float(time_budget)
+
+candidate_budget = pop_option("--candidate-budget")
+if candidate_budget is not None:
+    if not re.fullmatch("[1-9][0-9]*", candidate_budget):
+        sys.exit(f"Candidate budget must be a positive integer, not '{candidate_budget}'.")
+    candidate_budget = int(candidate_budget)
+
+progress_file = pop_option("--progress")
+
+objective = pop_option("--objective", "total")
+if objective not in ("total", "worst"):
+    sys.exit(f"Objective must be 'total' or 'worst', not '{objective}'.")
+
+search_mode = pop_option("--search", "beam")
+if search_mode not in ("beam", "exact"):
+    sys.exit(f"Search must be 'beam' or 'exact', not '{search_mode}'.")
+
+state_range = pop_option("--range")
+if state_range is not None:
+    match = re.fullmatch("([0-9]*):([0-9]*)", state_range)
+    if match is None:
+        sys.exit(f"Range must be '<start>:<stop>', not '{state_range}'.")
+    state_range = (int(match.group(1) or 0), int(match.group(2)) if match.group(2) else None)
+
 calculate_phi = False
 if len(sys.argv) > 2 and sys.argv[-1] == "phi":
-    import numpy
     import pyphi
+    from phistore import PhiStore, STORE_NAME, network_key
     del sys.argv[-1]
     calculate_phi = True
 
@@ -103,69 +186,274 @@ program_length = len(program)
 while len(program) < 256:
     program.append(("JMP", 0))
 
-zeroes = [0]*bits
-
-
-class Crash(Exception):
-    pass
-
-
-class Computer:
-    def __init__(self, A, B, I):
-        self.A = A.copy()  # list of int (0 or 1)
-        self.B = B.copy()  # list of int (0 or 1)
-        self.I = I         # int
-
-    def micro_step(self):
-        instruction = program[self.I]
-        operation = instruction[0]
-        operand = instruction[1]
-        if operation == "JMP":
-            if operand == 0:
-                self.A[:] = self.B
-                self.B[:] = zeroes
-                delta_I = None
+# Registers A and B are held as integers whose bit x is the register's bit x,
+# so states are only expanded into lists of 0/1 when they are printed or
+# handed to PyPhi.
+state_mask = (1 << bits) - 1
+
+# The program is compiled into parallel arrays indexed by instruction address,
+# so that executing an instruction is a couple of list lookups rather than
+# unpacking a tuple and comparing strings. For every instruction, the next
+# value of I is precomputed for both outcomes of reading A (only SKZ actually
+# distinguishes them), with CRASH where the jump would run past address 255.
+
+OP_END = 0
+OP_JMP = 1
+OP_SKZ = 2
+OP_SET = 3
+OP_CLR = 4
+
+CRASH = -1
+
+
+def compile_program(program):
+    opcodes = []
+    operands = []
+    next_if_zero = []
+    next_if_one = []
+    for i in range(len(program)):
+        operation, operand = program[i]
+        if operation == "JMP" and operand == 0:
+            opcode = OP_END
+            zero_target = one_target = 0
+        elif operation == "JMP":
+            opcode = OP_JMP
+            zero_target = one_target = i + operand
+        elif operation == "SKZ":
+            opcode = OP_SKZ
+            zero_target = i + 2
+            one_target = i + 1
+        else:
+            opcode = OP_SET if operation == "SET" else OP_CLR
+            assert opcode == OP_SET or operation == "CLR"
+            zero_target = one_target = i + 1
+        opcodes.append(opcode)
+        operands.append(operand)
+        next_if_zero.append(zero_target if zero_target <= 255 else CRASH)
+        next_if_one.append(one_target if one_target <= 255 else CRASH)
+    return opcodes, operands, next_if_zero, next_if_one
+
+
+opcodes, operands, next_if_zero, next_if_one = compile_program(program)
+
+
+def execute(initial_state, path=None):
+    """Runs the compiled program for one macro step starting from the given
+       state, returning the following state (or None for a crash), the
+       number of micro steps taken, and the branches taken. The branches are
+       the outcomes of each SKZ as binary digits after a leading 1, so two
+       states have the same branches exactly when they take the same path.
+       If given, path is extended with the address of each instruction
+       executed."""
+    A = initial_state
+    B = 0
+    I = 0
+    count = 0
+    branches = 1
+    while True:
+        count += 1
+        if path is not None:
+            path.append(I)
+        opcode = opcodes[I]
+        if opcode == OP_SKZ:
+            if A >> operands[I] & 1:
+                I = next_if_one[I]
+                branches = branches << 1 | 1
             else:
-                delta_I = operand
+                I = next_if_zero[I]
+                branches <<= 1
+        elif opcode == OP_END:
+            return B, count, branches
         else:
-            if operation == "SKZ":
-                if self.A[operand]:
-                    delta_I = 1
+            if opcode == OP_SET:
+                B |= 1 << operands[I]
+            elif opcode == OP_CLR:
+                B &= ~(1 << operands[I])
+            I = next_if_zero[I]
+        if I == CRASH:
+            return None, count, branches
+
+
+def execute_all(start, stop):
+    """Runs the compiled program for one macro step from every initial state
+       from start up to (but not including) stop at once, with one lane per
+       state in NumPy arrays. Lanes are dropped as they reach END or crash,
+       so each micro step only touches the states still running. Returns
+       arrays indexed by initial state minus start: the following state,
+       whether it crashed, the number of micro steps taken, and a path id
+       that is equal for two states exactly when they executed the same
+       sequence of instructions."""
+    opcode_table = numpy.array(opcodes, dtype=numpy.uint8)
+    bit_table = numpy.left_shift(numpy.uint64(1), numpy.array(operands, dtype=numpy.uint64))
+    zero_table = numpy.array(next_if_zero, dtype=numpy.int16)
+    one_table = numpy.array(next_if_one, dtype=numpy.int16)
+
+    size = stop - start
+    following = numpy.zeros(size, dtype=numpy.uint64)
+    crashed = numpy.zeros(size, dtype=bool)
+    counts = numpy.zeros(size, dtype=numpy.int64)
+    path_ids = numpy.zeros(size, dtype=numpy.int64)
+
+    lanes = numpy.arange(size, dtype=numpy.int64)
+    A = numpy.arange(start, stop, dtype=numpy.uint64)
+    B = numpy.zeros(size, dtype=numpy.uint64)
+    I = numpy.zeros(size, dtype=numpy.int16)
+    # Running lanes have the same branch id exactly when they have taken the
+    # same branches so far. Each step multiplies it by 3 and adds 0 for a
+    # non-branch, 1 for a zero read, or 2 for a one read; it's renumbered
+    # densely whenever it gets close to overflowing.
+    branch = numpy.zeros(size, dtype=numpy.int64)
+    next_path_id = 0
+    count = 0
+    while lanes.size:
+        count += 1
+        opcode = opcode_table[I]
+        bit = bit_table[I]
+        is_skz = opcode == OP_SKZ
+        is_one = A & bit != 0
+        next_I = numpy.where(is_skz & is_one, one_table[I], zero_table[I])
+        is_set = opcode == OP_SET
+        B[is_set] |= bit[is_set]
+        is_clr = opcode == OP_CLR
+        B[is_clr] &= ~bit[is_clr]
+        branch = branch * 3 + is_skz * (1 + is_one)
+
+        is_end = opcode == OP_END
+        is_crash = next_I == CRASH
+        is_done = is_end | is_crash
+        if is_done.any():
+            done_lanes = lanes[is_done]
+            following[lanes[is_end]] = B[is_end]
+            crashed[lanes[is_crash]] = True
+            counts[done_lanes] = count
+            # Paths of different lengths never coincide, so ids only need to
+            # distinguish the lanes finishing at this step.
+            done_branches, done_ids = numpy.unique(branch[is_done], return_inverse=True)
+            path_ids[done_lanes] = next_path_id + done_ids.reshape(-1)
+            next_path_id += done_branches.size
+            running = ~is_done
+            lanes = lanes[running]
+            A = A[running]
+            B = B[running]
+            next_I = next_I[running]
+            branch = branch[running]
+        I = next_I
+        if branch.size and branch.max() >= 2**62 // 3:
+            branch = numpy.unique(branch, return_inverse=True)[1].reshape(-1).astype(numpy.int64)
+    return following, crashed, counts, path_ids
+
+
+def explore_paths():
+    """Walks every feasible path through the compiled program once, treating
+       each SKZ of a bit not already read on the path as a branch. Returns a
+       list of (path, care, value, following_state): the initial states that
+       take the path are those whose bits under the care mask match the value
+       mask, and they all lead to the same following state (or None for a
+       crash), since B only depends on which SET and CLR instructions ran."""
+    results = []
+    pending = [(0, 0, 0, 0, [])]
+    while pending:
+        I, care, value, B, path = pending.pop()
+        while True:
+            if I == CRASH:
+                results.append((path, care, value, None))
+                break
+            path.append(I)
+            opcode = opcodes[I]
+            if opcode == OP_SKZ:
+                bit = 1 << operands[I]
+                if not care & bit:
+                    care |= bit
+                    pending.append((next_if_one[I], care, value | bit, B, path.copy()))
+                    I = next_if_zero[I]
+                elif value & bit:
+                    I = next_if_one[I]
                 else:
-                    delta_I = 2
+                    I = next_if_zero[I]
+            elif opcode == OP_END:
+                results.append((path, care, value, B))
+                break
             else:
-                if operation == "SET":
-                    self.B[operand] = 1
-                else:
-                    assert operation == "CLR"
-                    self.B[operand] = 0
-                delta_I = 1
-        if delta_I is None:
-            self.I = 0
-        elif self.I + delta_I <= 255:
-            self.I += delta_I
-        else:
-            raise Crash
+                if opcode == OP_SET:
+                    B |= 1 << operands[I]
+                elif opcode == OP_CLR:
+                    B &= ~(1 << operands[I])
+                I = next_if_zero[I]
+    return results
+
+
+def merge_cubes(cubes):
+    """Returns the prime implicants of the union of the given (care, value)
+       cubes, found by splitting on one bit at a time. Each prime either
+       doesn't care about the bit, and then it's a maximal intersection of
+       the primes of the two halves, or it's a prime of one half that isn't
+       covered by any of those."""
+    memo = {}
+
+    def covers(cube, other):
+        # Whether every state in other is also in cube.
+        return cube[0] & ~other[0] == 0 and other[1] & cube[0] == cube[1]
+
+    def primes(cubes):
+        if not cubes:
+            return frozenset()
+        if (0, 0) in cubes:
+            return frozenset([(0, 0)])
+        if cubes in memo:
+            return memo[cubes]
+        # Any bit a cube cares about will do, and picking it has to be
+        # cheap, since there can be a cube for every path.
+        care = min(cubes)[0]
+        bit = care & -care
+        low = primes(frozenset(
+            (care & ~bit, value) for care, value in cubes if not value & bit
+        ))
+        high = primes(frozenset(
+            (care & ~bit, value & ~bit) for care, value in cubes
+            if value & bit or not care & bit
+        ))
+        both = {
+            (care | other_care, value | other_value)
+            for care, value in low
+            for other_care, other_value in high
+            if (value ^ other_value) & care & other_care == 0
+        }
+        both = {
+            cube for cube in both
+            if not any(other != cube and covers(other, cube) for other in both)
+        }
+        result = frozenset(
+            both
+            | {(care | bit, value) for care, value in low
+               if not any(covers(cube, (care, value)) for cube in both)}
+            | {(care | bit, value | bit) for care, value in high
+               if not any(covers(cube, (care, value)) for cube in both)}
+        )
+        memo[cubes] = result
+        return result
+
+    return sorted(primes(frozenset(cubes)))
+
+
+def format_cube(care, value):
+    literals = [
+        ("" if value >> b & 1 else "~") + f"A[{b}]"
+        for b in range(bits)
+        if care >> b & 1
+    ]
+    return " & ".join(literals) if literals else "1"
 
 
 def next_state(prev_state):
-    computer = Computer(prev_state, zeroes, 0)
-    count = 0
-    while True:
-        count += 1
-        try:
-            computer.micro_step()
-        except Crash:
-            return None, count
-        if computer.I == 0:
-            return computer.A, count
+    following_state, count, branches = execute(prev_state)
+    return following_state, count
 
 
 def run_from(state_str):
-    state = str_to_state(state_str, bits)
+    state = state_to_int(str_to_state(state_str, bits))
     try:
         while state is not None:
-            print(f"\r{state_to_str(state)}", end="")
+            print(f"\r{int_to_str(state)}", end="")
             state, count = next_state(state)
             time.sleep(count * .1)
         print("\rcrash" + (" " * (bits - 5)))
@@ -173,62 +461,396 @@ def run_from(state_str):
         print()
 
 
+# The binary form of the "test prep" output is a header followed by one record
+# per initial state in order, each holding the following state in as many
+# little-endian bytes as it takes plus a 16-bit micro step count, which has
+# CRASH_FLAG added (and a zero state) for a crash. Cached transition tables
+# are stored the same way.
+FIXTURE_HEADER = struct.Struct("<4sBB")  # magic, version, bits
+FIXTURE_MAGIC = b"IITT"
+FIXTURE_VERSION = 1
+CRASH_FLAG = 0x8000
+
+
+def pack_transition(following_state, count, width):
+    if following_state is None:
+        return bytes(width) + (count | CRASH_FLAG).to_bytes(2, "little")
+    return following_state.to_bytes(width, "little") + count.to_bytes(2, "little")
+
+
+def unpack_transition(record, width):
+    """Returns (following_state, count) from a record made by
+       pack_transition()."""
+    count = int.from_bytes(record[width:], "little")
+    if count & CRASH_FLAG:
+        return None, count ^ CRASH_FLAG
+    return int.from_bytes(record[:width], "little"), count
+
+
+# Analysis results are cached on disk under a hash of the program as parsed,
+# so spacing, case and spelling (e.g. NOP vs. JMP +1) don't matter. Each
+# program has a transition table in the fixture format, a JSON file with the
+# connectivity matrix and black-box candidates, and a micro TPM of uint64
+# micro states. Files are written under temporary names and renamed into
+# place once complete, and the least recently used ones are deleted when the
+# cache grows past CACHE_LIMIT bytes. Phi journals of micro sweeps and the
+# phi store shared with snap/snap.py are kept here too but never deleted.
+CACHE_VERSION = 1
+CACHE_LIMIT = 2**30
+MICRO_MAGIC = b"IITM"
+
+program_hash = hashlib.sha256(
+    json.dumps([CACHE_VERSION, program[:program_length]]).encode()
+).hexdigest()
+
+
+def cache_path(kind):
+    return os.path.join(cache_dir, f"{program_hash}.{kind}")
+
+
+def open_cached(kind, size):
+    """Returns a read-only memory map of the cache file of the given kind if
+       it has the expected size and a valid header, or else None."""
+    if cache_dir is None:
+        return None
+    try:
+        with open(cache_path(kind), "rb") as f:
+            if os.fstat(f.fileno()).st_size != size:
+                return None
+            table = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        os.utime(cache_path(kind))
+    except (OSError, ValueError):
+        return None
+    magic, version, table_bits = FIXTURE_HEADER.unpack(table[:FIXTURE_HEADER.size])
+    if magic != {"transitions": FIXTURE_MAGIC, "micro": MICRO_MAGIC}[kind] \
+            or version != FIXTURE_VERSION or table_bits != bits:
+        return None
+    return table
+
+
+def open_cache_entry(size):
+    """Returns a temporary file to write a new cache file into, or None if
+       caching is off, the file would be too big to keep, or the cache
+       directory can't be written."""
+    if cache_dir is None or size > CACHE_LIMIT:
+        return None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        return tempfile.NamedTemporaryFile(dir=cache_dir, prefix=".tmp-", delete=False)
+    except OSError:
+        return None
+
+
+def close_cache_entry(entry_file, kind, completed):
+    """Closes a file from open_cache_entry(), moving it into place as the
+       cache file of the given kind if completed or else deleting it."""
+    entry_file.close()
+    if not completed:
+        os.unlink(entry_file.name)
+        return
+    os.replace(entry_file.name, cache_path(kind))
+    evict_cache()
+
+
+def evict_cache():
+    """Deletes the least recently used cache files until the cache fits in
+       CACHE_LIMIT, along with temporary files abandoned over a day ago."""
+    files = []
+    for entry in os.scandir(cache_dir):
+        try:
+            info = entry.stat()
+        except OSError:
+            continue
+        if entry.name.endswith(".journal") or entry.name.startswith("phi.sqlite"):
+            continue
+        elif not entry.name.startswith(".tmp-"):
+            files.append((info.st_mtime, info.st_size, entry.path))
+        elif info.st_mtime < time.time() - 86400:
+            files.append((0, 0, entry.path))
+    total_size = sum(size for _, size, _ in files)
+    for mtime, size, path in sorted(files):
+        if mtime and total_size <= CACHE_LIMIT:
+            break
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        total_size -= size
+
+
+def read_cached_analysis():
+    """Returns (bb_candidates, connectivity, transitions) from the cache, where
+       transitions generates the rows of the cached transition table, or None
+       if there isn't a valid entry for the program."""
+    width = (bits + 7) // 8
+    table = open_cached("transitions", FIXTURE_HEADER.size + 2**bits * (width + 2))
+    if table is None:
+        return None
+    try:
+        with open(cache_path("json")) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if entry.get("program") != [list(instruction) for instruction in program[:program_length]]:
+        return None
+    bb_candidates = [(set(reads), set(writes)) for reads, writes in entry["bb_candidates"]]
+
+    def gen_cached_transitions():
+        offset = FIXTURE_HEADER.size
+        for initial_state in range(2**bits):
+            following_state, count = unpack_transition(table[offset:offset + width + 2], width)
+            offset += width + 2
+            yield initial_state, following_state, count
+
+    return bb_candidates, entry["connectivity"], gen_cached_transitions()
+
+
+def write_cached_analysis(bb_candidates, connectivity):
+    entry_file = open_cache_entry(0)
+    if entry_file is None:
+        return
+    entry_file.write(json.dumps({
+        "program": program[:program_length],
+        "connectivity": connectivity,
+        "bb_candidates": [[sorted(reads), sorted(writes)] for reads, writes in bb_candidates],
+    }).encode())
+    close_cache_entry(entry_file, "json", True)
+
+
+# The largest number of initial states analyzed together, which bounds the
+# memory used for transitions that are streamed rather than kept.
+SHARD_SIZE = 2**16
+
+
 class Analyzer:
     def __init__(self):
         self.bb_candidates = [(set(), set()) for _ in range(256)]
         self.connectivity = [[0 for _ in range(bits)] for _ in range(bits)]
         self.transitions = []
-
-    def perform_analysis(self):
-        ended_paths = []
-        crashed_paths = []
-
-        for initial_state in gen_states():
-            computer = Computer(initial_state, zeroes, 0)
-            path = []
-            while True:
-                path.append(computer.I)
-                try:
-                    computer.micro_step()
-                except Crash:
-                    following_state = None
-                    break
-                if computer.I == 0:
-                    following_state = computer.A
-                    break
-            self.transitions.append((initial_state, following_state, len(path)))
-            (crashed_paths if following_state is None else ended_paths).append(path)
-
-        paths_per_read_per_inst = [[0 for _ in range(256)] for _ in range(256)]
-
-        for path in ended_paths + crashed_paths:
-            reads = []
-            for i in path:
-                if program[i][0] == "SKZ":
-                    reads.append(i)
+        self.symbolic_paths = None
+
+    def perform_analysis(self, need_transitions=True):
+        """Runs the whole analysis, keeping the transition table in
+           self.transitions unless it isn't needed."""
+        if engine == "symbolic" and not need_transitions:
+            self.analyze_symbolically()
+        elif need_transitions:
+            self.transitions = list(self.gen_transitions())
+        else:
+            for _ in self.gen_transitions():
+                pass
+
+    def gen_transitions(self):
+        """Generates (initial_state, following_state, count) for every initial
+           state in order, as they are computed or read from the cache. The
+           black-box candidates and connectivity matrix are only filled in
+           once the generator has been exhausted."""
+        if engine == "symbolic":
+            self.analyze_symbolically()
+            # Every initial state matching a path's cube takes exactly that
+            # path, so the table is filled in by expanding each cube over
+            # the bits it doesn't care about.
+            following_states = [None] * 2**bits
+            counts = [0] * 2**bits
+            for path, care, value, following_state in self.symbolic_paths:
+                free = ~care & (2**bits - 1)
+                subset = free
+                while True:
+                    following_states[value | subset] = following_state
+                    counts[value | subset] = len(path)
+                    if not subset:
+                        break
+                    subset = (subset - 1) & free
+            for initial_state in range(2**bits):
+                yield initial_state, following_states[initial_state], counts[initial_state]
+            return
+        cached = read_cached_analysis()
+        if cached is not None:
+            self.bb_candidates, self.connectivity, transitions = cached
+            yield from transitions
+            return
+        width = (bits + 7) // 8
+        entry_file = open_cache_entry(FIXTURE_HEADER.size + 2**bits * (width + 2))
+        if entry_file is None:
+            yield from self.compute_transitions()
+            return
+        # The transition table is written to the cache as it's streamed, and
+        # only kept if the caller gets through all of it.
+        completed = False
+        try:
+            entry_file.write(FIXTURE_HEADER.pack(FIXTURE_MAGIC, FIXTURE_VERSION, bits))
+            records = bytearray()
+            for initial_state, following_state, count in self.compute_transitions():
+                yield initial_state, following_state, count
+                records += pack_transition(following_state, count, width)
+                if len(records) >= 2**16:
+                    entry_file.write(records)
+                    records.clear()
+            entry_file.write(records)
+            completed = True
+        finally:
+            close_cache_entry(entry_file, "transitions", completed)
+        write_cached_analysis(self.bb_candidates, self.connectivity)
+
+    def compute_transitions(self):
+        """Like gen_transitions() but always enumerating the initial states
+           with the NumPy or Python engine."""
+        # The initial states are split into contiguous shards, a few per job
+        # so that uneven shards balance out. The read counts have to be
+        # summed over all shards before the dataflow can be traced, so that
+        # happens afterwards over chunks of the distinct ended paths. Only a
+        # couple of shards per job are handed out ahead of the one being
+        # yielded, so that memory stays flat however many jobs there are.
+        shard_count = min(2**bits, max(jobs * 4, 2**bits // SHARD_SIZE))
+        bounds = [2**bits * s // shard_count for s in range(shard_count + 1)]
+        shards = zip(bounds[:-1], bounds[1:])
+        with multiprocessing.get_context("fork").Pool(jobs) if jobs > 1 else nullcontext() as pool:
+            ended_paths = {}
+            paths_per_read_per_inst = None
+            for transitions, shard_paths, shard_counts in (
+                imap_bounded(pool, analyze_shard, shards, 2 * jobs) if pool else map(analyze_shard, shards)
+            ):
+                yield from transitions
+                for path, _, ended in shard_paths:
+                    if ended:
+                        ended_paths[tuple(path)] = (path, 1, ended)
+                if paths_per_read_per_inst is None:
+                    paths_per_read_per_inst = shard_counts
+                else:
+                    for row, shard_row in zip(paths_per_read_per_inst, shard_counts):
+                        for r in range(256):
+                            row[r] += shard_row[r]
+            ended_paths = list(ended_paths.values())
+            if not pool:
+                self.bb_candidates, self.connectivity = trace_dataflow(
+                    ended_paths, paths_per_read_per_inst
+                )
+                return
+            chunks = [ended_paths[c::jobs] for c in range(jobs)]
+            for bb_candidates, connectivity in pool.starmap(
+                trace_dataflow, [(chunk, paths_per_read_per_inst) for chunk in chunks]
+            ):
+                for merged, chunk_bb in zip(self.bb_candidates, bb_candidates):
+                    merged[0].update(chunk_bb[0])
+                    merged[1].update(chunk_bb[1])
+                for merged_row, chunk_row in zip(self.connectivity, connectivity):
+                    for target in range(bits):
+                        merged_row[target] |= chunk_row[target]
+
+    def analyze_symbolically(self):
+        self.symbolic_paths = explore_paths()
+        paths = [
+            (path, 2**(bits - bin(care).count("1")), following_state is not None)
+            for path, care, value, following_state in self.symbolic_paths
+        ]
+        self.bb_candidates, self.connectivity = trace_dataflow(paths, count_reads(paths))
+
+
+def execute_range(start, stop):
+    """Executes the initial states from start up to (but not including) stop,
+       returning their transitions plus a list of (path, multiplicity, ended)
+       for the distinct paths taken."""
+    if engine == "numpy":
+        return execute_range_vectorized(start, stop)
+    transitions = []
+    representatives = {}
+    multiplicities = {}
+    for initial_state in range(start, stop):
+        following_state, count, branches = execute(initial_state)
+        transitions.append((initial_state, following_state, count))
+        if branches in multiplicities:
+            multiplicities[branches] += 1
+        else:
+            representatives[branches] = initial_state
+            multiplicities[branches] = 1
+    paths = []
+    for branches, initial_state in representatives.items():
+        path = []
+        following_state, count, _ = execute(initial_state, path)
+        paths.append((path, multiplicities[branches], following_state is not None))
+    return transitions, paths
+
+
+def execute_range_vectorized(start, stop):
+    """Like execute_range() but using execute_all()."""
+    following, crashed, counts, path_ids = execute_all(start, stop)
+    transitions = [
+        (initial_state, None if crash else following_state, count)
+        for initial_state, following_state, crash, count in zip(
+            range(start, stop), following.tolist(), crashed.tolist(), counts.tolist()
+        )
+    ]
+    paths = []
+    _, representatives, multiplicities = numpy.unique(
+        path_ids, return_index=True, return_counts=True
+    )
+    for offset, multiplicity in zip(representatives.tolist(), multiplicities.tolist()):
+        path = []
+        following_state, count, _ = execute(start + offset, path)
+        paths.append((path, multiplicity, following_state is not None))
+    return transitions, paths
+
+
+def analyze_shard(bounds):
+    transitions, paths = execute_range(*bounds)
+    return transitions, paths, count_reads(paths)
+
+
+def imap_bounded(pool, function, items, window):
+    """Like pool.imap(), but with at most window items handed out to the
+       workers at once, so that they can't run ahead of the caller and fill
+       memory with results it hasn't got to yet."""
+    pending = deque()
+    for item in items:
+        if len(pending) == window:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(function, (item,)))
+    while pending:
+        yield pending.popleft().get()
+
+
+def count_reads(paths):
+    """Counts, for each instruction i and read r, how many executions of i
+       came after r on the same path."""
+    paths_per_read_per_inst = [[0 for _ in range(256)] for _ in range(256)]
+    for path, multiplicity, ended in paths:
+        reads = []
+        for i in path:
+            if opcodes[i] == OP_SKZ:
+                reads.append(i)
+            for r in reads:
+                paths_per_read_per_inst[i][r] += multiplicity
+    return paths_per_read_per_inst
+
+
+def trace_dataflow(paths, paths_per_read_per_inst):
+    """Traces which reads each write depends on along the ended paths,
+       returning the black-box candidates and connectivity matrix."""
+    bb_candidates = [(set(), set()) for _ in range(256)]
+    connectivity = [[0 for _ in range(bits)] for _ in range(bits)]
+    for path, multiplicity, ended in paths:
+        if not ended:
+            continue
+        reads = []
+        for i in path:
+            reads = [
+                r for r in reads
+                if paths_per_read_per_inst[i][r] != paths_per_read_per_inst[r][r]
+            ]
+            opcode = opcodes[i]
+            if opcode == OP_SKZ:
+                reads.append(i)
+            elif opcode == OP_SET or opcode == OP_CLR:
+                target = operands[i]
+                bb_candidates[i][1].add(target)
                 for r in reads:
-                    paths_per_read_per_inst[i][r] += 1
-
-        for path in ended_paths:
-            reads = []
-            for i in path:
-                reads = [
-                    r for r in reads
-                    if paths_per_read_per_inst[i][r] != paths_per_read_per_inst[r][r]
-                ]
-                operation = program[i][0]
-                if operation == "SKZ":
-                    reads.append(i)
-                elif operation == "SET" or operation == "CLR":
-                    target = program[i][1]
-                    self.bb_candidates[i][1].add(target)
-                    for r in reads:
-                        source = program[r][1]
-                        self.connectivity[source][target] = 1
-                        for x in path:
-                            if r <= x <= i:
-                                self.bb_candidates[x][0].add(source)
-                                self.bb_candidates[x][1].add(target)
+                    source = operands[r]
+                    connectivity[source][target] = 1
+                    for x in path:
+                        if r <= x <= i:
+                            bb_candidates[x][0].add(source)
+                            bb_candidates[x][1].add(target)
+    return bb_candidates, connectivity
 
 
 def int_to_state(state_int, b=bits):
@@ -249,39 +871,197 @@ def str_to_state(state_str, b=bits):
     return [int(s) for s in state_str]
 
 
-def state_to_str(state):
-    return "".join([str(s) for s in state])
+def int_to_str(state_int, b=bits):
+    return format(state_int, f"0{b}b")[::-1] if b else ""
+
 
+phi_network = None
+phi_network_key = None
+phi_store = None
 
-def gen_states(b=bits):
-    for i in range(2**b):
-        yield int_to_state(i, b)
+
+def init_phi_worker(tpm, cm, in_pool=False):
+    """Builds the network for compute_phi. A pool worker is daemonic and so
+       can't start processes of its own, which PyPhi would otherwise do to
+       evaluate cuts in parallel, so that's turned off inside the pool."""
+    global phi_network, phi_network_key, phi_store
+    if in_pool:
+        for name in pyphi.config.snapshot():
+            if name.startswith("PARALLEL_"):
+                setattr(pyphi.config, name, False)
+    phi_network = pyphi.Network(tpm=tpm, cm=cm)
+    if cache_dir is not None:
+        phi_network_key = network_key(tpm, cm)
+        phi_store = PhiStore(os.path.join(cache_dir, STORE_NAME))
+
+
+def compute_phi(state):
+    """Returns the phi value of the given state of phi_network, or None if the
+       state is unreachable, from the phi store if it's there already."""
+    if phi_store is not None:
+        found, phi = phi_store.get(phi_network_key, state)
+        if found:
+            return phi
+    try:
+        phi = pyphi.compute.phi(pyphi.Subsystem(phi_network, state))
+    except pyphi.exceptions.StateUnreachableError:
+        phi = None
+    if phi_store is not None:
+        phi_store.put(phi_network_key, state, phi)
+    return phi
+
+
+def gen_phis(tpm, cm, states):
+    """Generates the phi value of each of the given states, in order, for the
+       network with the given TPM and connectivity matrix. With more than one
+       job the states are handed out to worker processes, each of which
+       builds the network once, and the values are yielded as soon as all
+       the earlier ones are in."""
+    with multiprocessing.get_context("fork").Pool(
+        jobs, init_phi_worker, (tpm, cm, True)
+    ) if jobs > 1 else nullcontext() as pool:
+        if pool:
+            yield from pool.imap(compute_phi, states)
+        else:
+            init_phi_worker(tpm, cm)
+            yield from map(compute_phi, states)
+
+
+def find_reachable(following_states, state_count):
+    """Returns a NumPy array of booleans marking which of the state_count
+       states are the following state of some state. PyPhi rejects all the
+       others as unreachable, so they can be skipped without asking it."""
+    reachable = numpy.zeros(state_count, dtype=bool)
+    reachable[numpy.array(following_states, dtype=numpy.uint64)] = True
+    return reachable
+
+
+def find_orbits(following, cm):
+    """Returns a NumPy array mapping each state to the smallest state in its
+       orbit under the automorphisms of the network, given the following
+       state of every state as a NumPy array and the connectivity matrix,
+       along with the number of automorphisms. An automorphism is a
+       permutation of the bits that preserves both the TPM and the
+       connectivity matrix, so it preserves phi too."""
+    n = len(cm)
+    states = numpy.arange(len(following), dtype=numpy.uint64)
+    state_bits = [states >> i & 1 for i in range(n)]
+    following_bits = [following >> i & 1 for i in range(n)]
+    # A bit can only be mapped to one that looks the same in terms of its
+    # connections and how often it's set or kept, which prunes most of the
+    # permutations before the whole TPM has to be compared.
+    signatures = [
+        (
+            cm[b][b],
+            sum(row[b] for row in cm),
+            sum(cm[b]),
+            int(following_bits[b].sum()),
+            int(numpy.count_nonzero(following_bits[b] == state_bits[b])),
+        )
+        for b in range(n)
+    ]
+
+    def permute(state_bits, permutation):
+        return sum(state_bits[b] << target for b, target in enumerate(permutation))
+
+    def gen_automorphisms(permutation):
+        k = len(permutation)
+        if k == n:
+            if numpy.array_equal(
+                following[permute(state_bits, permutation)],
+                permute(following_bits, permutation),
+            ):
+                yield permutation
+            return
+        for target in range(n):
+            if target in permutation or signatures[target] != signatures[k]:
+                continue
+            if any(
+                cm[k][j] != cm[target][permutation[j]] or cm[j][k] != cm[permutation[j]][target]
+                for j in range(k)
+            ):
+                continue
+            yield from gen_automorphisms(permutation + [target])
+
+    orbits = states
+    automorphism_count = 0
+    for permutation in gen_automorphisms([]):
+        orbits = numpy.minimum(orbits, permute(state_bits, permutation))
+        automorphism_count += 1
+    return orbits, automorphism_count
+
+
+def print_reachability(reachable, orbits, automorphism_count):
+    count = int(numpy.count_nonzero(reachable))
+    print(f"Reachable states: {count} of {len(reachable)} ({100 * count / len(reachable):.1f}%)")
+    representatives = int(numpy.count_nonzero(reachable & (orbits == numpy.arange(len(orbits)))))
+    print(f"Automorphisms: {automorphism_count} ({representatives} orbits of reachable states)")
+    print()
 
 
 def analyze():
     a = Analyzer()
-    a.perform_analysis()
     if calculate_phi:
-        network = pyphi.Network(
-            tpm=numpy.array([t for s, t, c in a.transitions]),
-            cm=numpy.array(a.connectivity),
+        a.perform_analysis()
+        transitions = a.transitions
+        following = numpy.array([t for s, t, c in transitions], dtype=numpy.uint64)
+        reachable = find_reachable(following, 2**bits)
+        orbits, automorphism_count = find_orbits(following, a.connectivity)
+        print_reachability(reachable, orbits, automorphism_count)
+        # Phi is only computed for the smallest state of each orbit, which
+        # always comes first, and copied to the rest of the orbit.
+        phis = gen_phis(
+            numpy.array([int_to_state(t) for s, t, c in transitions]),
+            numpy.array(a.connectivity),
+            (int_to_state(s) for s, t, c in transitions if reachable[s] and orbits[s] == s),
         )
-    print("Transition table:")
-    for initial_state, following_state, count in a.transitions:
-        line = f"{state_to_str(initial_state)} -> "
-        if following_state is None:
-            line += "crash"
-        else:
-            line += f"{state_to_str(following_state)}"
-        line += f" in {count:2} micro steps"
-        if calculate_phi:
-            try:
-                phi = pyphi.compute.phi(pyphi.Subsystem(network, initial_state))
-                line += f" (phi = {phi})"
-            except pyphi.exceptions.StateUnreachableError:
-                line += " (unreachable)"
-        print(line)
-    print()
+        orbit_phis = {}
+    elif engine == "symbolic":
+        a.perform_analysis(need_transitions=False)
+        transitions = None
+    else:
+        # The transition table is printed as it's computed, so it never has
+        # to be held in memory.
+        transitions = a.gen_transitions()
+    if a.symbolic_paths is not None:
+        print("Next-state functions:")
+        for b in range(bits):
+            cubes = merge_cubes(
+                (care, value)
+                for path, care, value, following_state in a.symbolic_paths
+                if following_state is not None and following_state >> b & 1
+            )
+            print(f"B[{b}] = " + (" | ".join(format_cube(*c) for c in cubes) if cubes else "0"))
+        crash_cubes = merge_cubes(
+            (care, value)
+            for path, care, value, following_state in a.symbolic_paths
+            if following_state is None
+        )
+        if crash_cubes:
+            print("crash = " + " | ".join(format_cube(*c) for c in crash_cubes))
+        print()
+    if transitions is not None:
+        print("Transition table:")
+        for initial_state, following_state, count in transitions:
+            line = f"{int_to_str(initial_state)} -> "
+            if following_state is None:
+                line += "crash"
+            else:
+                line += f"{int_to_str(following_state)}"
+            line += f" in {count:2} micro steps"
+            if calculate_phi:
+                if not reachable[initial_state]:
+                    phi = None
+                elif orbits[initial_state] == initial_state:
+                    phi = orbit_phis[initial_state] = next(phis)
+                else:
+                    phi = orbit_phis[int(orbits[initial_state])]
+                if phi is None:
+                    line += " (unreachable)"
+                else:
+                    line += f" (phi = {phi})"
+            print(line)
+        print()
     print("Connectivity matrix:")
     for row in a.connectivity:
         print("[" + ", ".join([str(value) for value in row]) + "]")
@@ -318,26 +1098,113 @@ def analyze():
         print(f"{printable: <8}->{assignment: >3}")
 
 
+def micro_rule(i, ab):
+    """Applies the instruction at address i to ab, which packs A | B << bits
+       and is either an int or a NumPy array of them, and returns the
+       following micro state(s) packed as A | B << bits | I << 2*bits. When
+       the instruction crashes, the registers are still updated but I stays
+       put."""
+    opcode = opcodes[i]
+    zero_target = i if next_if_zero[i] == CRASH else next_if_zero[i]
+    one_target = i if next_if_one[i] == CRASH else next_if_one[i]
+    if opcode == OP_END:
+        return ab >> bits
+    elif opcode == OP_SKZ:
+        read = ab >> operands[i] & 1
+        return ab | (zero_target ^ (zero_target ^ one_target) * read) << 2*bits
+    elif opcode == OP_SET:
+        ab = ab | 1 << bits + operands[i]
+    elif opcode == OP_CLR:
+        ab = ab & ((state_mask << bits | state_mask) ^ 1 << bits + operands[i])
+    return ab | zero_target << 2*bits
+
+
+def gen_micro_blocks(i_bits, vectorized):
+    """Generates (i, following) for every value of I in turn, where following
+       holds the following micro states of all the micro states with that I,
+       in order. If vectorized, each block is computed by micro_rule() at once
+       as a NumPy array, and otherwise as a list."""
+    block_size = 2**(2*bits)
+    table_size = FIXTURE_HEADER.size + 2**i_bits * block_size * 8
+    table = open_cached("micro", table_size)
+    if table is not None:
+        for i in range(2**i_bits):
+            offset = FIXTURE_HEADER.size + i * block_size * 8
+            if vectorized:
+                yield i, numpy.frombuffer(table, "<u8", block_size, offset).astype(numpy.uint64)
+            else:
+                following = array("Q", table[offset:offset + block_size * 8])
+                if sys.byteorder == "big":
+                    following.byteswap()
+                yield i, following.tolist()
+        return
+    entry_file = open_cache_entry(table_size)
+    completed = False
+    try:
+        if entry_file is not None:
+            entry_file.write(FIXTURE_HEADER.pack(MICRO_MAGIC, FIXTURE_VERSION, bits))
+        for i in range(2**i_bits):
+            if vectorized:
+                following = micro_rule(i, numpy.arange(block_size, dtype=numpy.uint64))
+            else:
+                following = [micro_rule(i, ab) for ab in range(block_size)]
+            yield i, following
+            if entry_file is not None:
+                if vectorized:
+                    entry_file.write(following.astype("<u8").tobytes())
+                else:
+                    following = array("Q", following)
+                    if sys.byteorder == "big":
+                        following.byteswap()
+                    entry_file.write(following.tobytes())
+        completed = True
+    finally:
+        if entry_file is not None:
+            close_cache_entry(entry_file, "micro", completed)
+
+
+def read_journal(path, network):
+    """Returns a dict of the phi values (or None for unreachable states)
+       recorded in the given journal for the network with the given
+       network_key(), which covers the PyPhi configuration, keyed by state
+       string. Lines for other networks or configurations are ignored, so
+       journals from separate sweeps can just be concatenated, and so is a
+       partly written last line."""
+    journal = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("network") == network:
+                    journal[entry["state"]] = entry["phi"]
+    except FileNotFoundError:
+        pass
+    return journal
+
+
+def open_journal(path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    output = open(path, "a")
+    if output.tell() > 0:
+        # Starts on a fresh line in case the last run died partway through one.
+        with open(path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                output.write("\n")
+    return output
+
+
 def micro_analyze():
     i_bits = int.bit_length(program_length-1)
+    # Checked for every address up front, so that nothing is printed first.
+    if any(max(next_if_zero[i], next_if_one[i]) >= 2**i_bits for i in range(2**i_bits)):
+        sys.exit("I exceeded given program length.")
     total_bits = 2 * bits + i_bits
-    transitions = []
-    for abi in gen_states(total_bits):
-        a = abi[0:bits]
-        b = abi[bits:2*bits]
-        i = state_to_int(abi[2*bits:])
-        computer = Computer(a, b, i)
-        try:
-            computer.micro_step()
-        except Crash:
-            pass  # The registers are correct even when crashing.
-        assert len(computer.A) == bits
-        assert len(computer.B) == bits
-        if computer.I >= 2 ** i_bits:
-            sys.exit("I exceeded given program length.")
-        transitions.append(
-            (abi, computer.A + computer.B + int_to_state(computer.I, i_bits))
-        )
     connectivity = [[0 for _ in range(total_bits)] for _ in range(total_bits)]
     a_indexes = range(0, bits)
     b_indexes = range(bits, 2 * bits)
@@ -358,29 +1225,80 @@ def micro_analyze():
             connectivity[row][col] = 1
     if calculate_phi:
         print()
-        network = pyphi.Network(
-            tpm=numpy.array([t for s, t in transitions]),
-            cm=numpy.array(connectivity),
+        tpm = numpy.empty((2**total_bits, total_bits), dtype=numpy.uint8)
+        node_shifts = numpy.arange(total_bits, dtype=numpy.uint64)
+        following_states = numpy.empty(2**total_bits, dtype=numpy.uint64)
+        for i, following in gen_micro_blocks(i_bits, vectorized=True):
+            tpm[i << 2*bits:i + 1 << 2*bits] = following[:, numpy.newaxis] >> node_shifts & 1
+            following_states[i << 2*bits:i + 1 << 2*bits] = following
+        reachable = find_reachable(following_states, 2**total_bits)
+        orbits, automorphism_count = find_orbits(following_states, connectivity)
+        print_reachability(reachable, orbits, automorphism_count)
+        if micro_state:
+            if state_range is not None:
+                sys.exit("A range can't be given along with a single state.")
+            states = [state_to_int(str_to_state(micro_state, total_bits))]
+        else:
+            start, stop = state_range or (0, None)
+            stop = 2**total_bits if stop is None else min(stop, 2**total_bits)
+            states = range(start, stop)
+        # Each phi value is appended to the journal as soon as it's known, and
+        # the states already in it are skipped when the sweep is run again.
+        # Only the smallest state of each orbit is computed and journaled,
+        # even when it's outside the range.
+        journal_path = journal_file or (cache_dir and cache_path("journal"))
+        network = network_key(tpm, connectivity)
+        journal = read_journal(journal_path, network) if journal_path else {}
+        pending = {}
+        for s in states:
+            representative = int(orbits[s])
+            if (
+                reachable[s]
+                and int_to_str(s, total_bits) not in journal
+                and int_to_str(representative, total_bits) not in journal
+            ):
+                pending[representative] = None
+        phis = gen_phis(
+            tpm,
+            numpy.array(connectivity),
+            [int_to_state(s, total_bits) for s in pending],
         )
-        for state_array in (
-            [str_to_state(micro_state, total_bits)]
-            if micro_state
-            else gen_states(total_bits)
-        ):
-            print(f"Computing phi for {state_to_str(state_array)}...")
-            try:
-                phi = pyphi.compute.phi(pyphi.Subsystem(network, state_array))
-                print(f"* Phi = {phi}")
-            except pyphi.exceptions.StateUnreachableError:
+        journal_output = open_journal(journal_path) if journal_path else None
+        for state_int in states:
+            state_str = int_to_str(state_int, total_bits)
+            representative_str = int_to_str(int(orbits[state_int]), total_bits)
+            print(f"Computing phi for {state_str}...")
+            if not reachable[state_int]:
+                phi = None
+            elif state_str in journal:
+                phi = journal[state_str]
+            elif representative_str in journal:
+                phi = journal[representative_str]
+            else:
+                phi = journal[representative_str] = next(phis)
+                if journal_output is not None:
+                    journal_output.write(json.dumps(
+                        {"network": network, "state": representative_str, "phi": phi}
+                    ) + "\n")
+                    journal_output.flush()
+            if phi is None:
                 print("* Unreachable")
+            else:
+                print(f"* Phi = {phi}")
+        if journal_output is not None:
+            journal_output.close()
     else:
         print("import numpy")
         print("import pyphi")
         print()
         print("tpm = [")
-        for initial_state, following_state in transitions:
-            print("    [" + ", ".join([str(value) for value in following_state]) + "],", end="")
-            print("  # <- [" + ", ".join([str(value) for value in initial_state]) + "]")
+        vectorized = engine == "numpy"
+        for i, following in gen_micro_blocks(i_bits, vectorized):
+            initial_state = i << 2*bits
+            for following_state in (following.tolist() if vectorized else following):
+                print("    [" + ", ".join(int_to_str(following_state, total_bits)) + "],", end="")
+                print("  # <- [" + ", ".join(int_to_str(initial_state, total_bits)) + "]")
+                initial_state += 1
         print("]")
         print()
         print("cm = [")
@@ -403,7 +1321,7 @@ def micro_analyze():
 
 def diagram():
     a = Analyzer()
-    a.perform_analysis()
+    a.perform_analysis(need_transitions=False)
     print(r"\begin{tikzpicture}[scale=.5, transform shape, line cap=rect]")
     last = 0
     edges = []
@@ -470,66 +1388,270 @@ def diagram():
 
 def test_prep():
     a = Analyzer()
-    a.perform_analysis()
-    expected = a.transitions
+    if prep_format == "bin":
+        width = (bits + 7) // 8
+        output = sys.stdout.buffer
+        output.write(FIXTURE_HEADER.pack(FIXTURE_MAGIC, FIXTURE_VERSION, bits))
+        records = bytearray()
+        for initial_state, following_state, count in a.gen_transitions():
+            records += pack_transition(following_state, count, width)
+            if len(records) >= 2**16:
+                output.write(records)
+                records.clear()
+        output.write(records)
+        return
     print("[")
-    for i in range(len(expected)):
-        print("  " + json.dumps(expected[i]) + ("," if i < len(expected)-1 else ""))
+    separator = ""
+    for initial_state, following_state, count in a.gen_transitions():
+        row = (
+            int_to_state(initial_state),
+            None if following_state is None else int_to_state(following_state),
+            count,
+        )
+        print(separator + "  " + json.dumps(row), end="")
+        separator = ",\n"
+    print()
     print("]")
 
 
+def gen_json_array(text_file, chunk_size=2**16):
+    """Generates the elements of the JSON array making up the given file one
+       at a time, reading it in chunks rather than all at once, however the
+       array is laid out. Raises ValueError if it isn't a valid JSON array."""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    at_end = False
+    expecting = "["
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\n\r":
+            position += 1
+        if position == len(buffer) and not at_end:
+            chunk = text_file.read(chunk_size)
+            at_end = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        if position == len(buffer):
+            raise ValueError("Unexpected end of JSON array")
+        if expecting == "[":
+            if buffer[position] != "[":
+                raise ValueError(f"Expected a JSON array at {buffer[position:position + 20]!r}")
+            position += 1
+            expecting = "first"
+        elif buffer[position] == "]" and expecting in ("first", ","):
+            return
+        elif expecting == ",":
+            if buffer[position] != ",":
+                raise ValueError(f"Expected ',' or ']' at {buffer[position:position + 20]!r}")
+            position += 1
+            expecting = "element"
+        else:
+            # An element that's cut off (or that might go on, like a number)
+            # at the end of the buffer is parsed again once there's more.
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if at_end:
+                    raise
+                end = len(buffer)
+            if end == len(buffer) and not at_end:
+                chunk = text_file.read(chunk_size)
+                at_end = not chunk
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            yield element
+            position = end
+            expecting = ","
+
+
+def read_prep(prep_file):
+    """Generates (bits, initial_state, following_state) for each row of either
+       form of the output of test_prep(), one at a time. A binary fixture is
+       memory-mapped if it's a regular file."""
+    stream = prep_file.buffer
+    if stream.peek(len(FIXTURE_MAGIC))[:len(FIXTURE_MAGIC)] != FIXTURE_MAGIC:
+        for initial_state, following_state, count in gen_json_array(prep_file):
+            yield (
+                len(initial_state),
+                state_to_int(initial_state),
+                None if following_state is None else state_to_int(following_state),
+            )
+        return
+    magic, version, fixture_bits = FIXTURE_HEADER.unpack(stream.read(FIXTURE_HEADER.size))
+    if version != FIXTURE_VERSION:
+        sys.exit(f"Unsupported fixture version {version}.")
+    fixture = None
+    if stat.S_ISREG(os.fstat(stream.fileno()).st_mode):
+        fixture = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+    width = (fixture_bits + 7) // 8
+    record_size = width + 2
+    offset = FIXTURE_HEADER.size
+    for initial_state in range(2**fixture_bits):
+        if fixture is not None:
+            record = fixture[offset:offset + record_size]
+            offset += record_size
+        else:
+            record = stream.read(record_size)
+        if len(record) < record_size:
+            return
+        following_state, count = unpack_transition(record, width)
+        yield fixture_bits, initial_state, following_state
+
+
 def test_check():
-    expected = json.load(sys.stdin)
     a = Analyzer()
-    a.perform_analysis()
-    actual = a.transitions
-    if len(actual) != len(expected):
-        sys.exit(f"Expected {len(expected)} transitions but actually {len(actual)}.")
-    mismatches = []
-    for i in range(len(actual)):
-        if expected[i][0] != actual[i][0]:
-            sys.exit(f"Expected starting state {expected[i][0]} but actually {actual[i][0]}.")
-        if expected[i][1] != actual[i][1]:
-            mismatches.append((expected[i][0], expected[i][1], actual[i][1]))
-    if len(mismatches) == 0:
-        print("Test passed!")
-    else:
-        print("Test failed. Mismatched transitions:")
-        for initial_state, expected_state, actual_state in mismatches:
-            print(f"{state_to_str(initial_state)} -> {state_to_str(expected_state)} vs. {state_to_str(actual_state)}")
+    expected_count = 0
+    actual_count = 0
+    failed = False
+    # Both sides are streamed and compared row by row, so neither transition
+    # table has to be held in memory.
+    for expected, actual in zip_longest(read_prep(sys.stdin), a.gen_transitions()):
+        expected_count += expected is not None
+        actual_count += actual is not None
+        if expected is None or actual is None:
+            continue
+        expected_bits, expected_initial, expected_following = expected
+        actual_initial, actual_following, count = actual
+        if expected_bits != bits:
+            sys.exit(f"Expected {2**expected_bits} transitions but actually {2**bits}.")
+        if expected_initial != actual_initial:
+            sys.exit(f"Expected starting state {int_to_state(expected_initial)} but actually {int_to_state(actual_initial)}.")
+        if expected_following != actual_following:
+            if not failed:
+                print("Test failed. Mismatched transitions:")
+                failed = True
+            expected_str = "crash" if expected_following is None else int_to_str(expected_following)
+            actual_str = "crash" if actual_following is None else int_to_str(actual_following)
+            print(f"{int_to_str(actual_initial)} -> {expected_str} vs. {actual_str}")
+    if expected_count != actual_count:
+        sys.exit(f"Expected {expected_count} transitions but actually {actual_count}.")
+    if failed:
         sys.exit(1)
+    print("Test passed!")
 
 
 @dataclass(frozen=True)
 class Candidate:
     instructions: tuple[str, ...]
     states: int
-    cost: int
+    cost: int  # Micro steps summed over all the states
+    worst: int  # Micro steps of the slowest state
 
 
 def generate_optimized_program():
+    global memo_width, search
     a = Analyzer()
     a.perform_analysis()
-    best_program = None
-    best_score = None
-    candidate_count = 0
+    search = SearchProgress(open(progress_file, "w") if progress_file else None)
+    # A quick greedy program is the one to beat, so that there's always
+    # something to print however soon the budget runs out.
+    best_program = greedy_candidate(a.transitions, set(range(bits)), [None for b in range(bits)])
+    best_score = optimization_score(best_program)
+    search.improved(best_score)
+    # The search is repeated with more and more candidates kept per
+    # sub-table, so that a decent program is found quickly and then
+    # improved on until the budget (if any) runs out. The exact search
+    # keeps every candidate that could still beat the greedy program.
+    if search_mode == "exact":
+        widths = [None]
+    else:
+        widths = [2**w for w in range(MEMO_WIDTH.bit_length())]
     try:
-        for gen_program in generate_branches(a.transitions, set(range(bits)), [None for b in range(bits)]):
-            candidate_count += 1
-            if candidate_count % 1000 == 0:
-                print(f"Processed {candidate_count} candidates, best score {best_score}", file=sys.stderr)
-            gen_score = optimization_score(gen_program)
-            if best_score is None or gen_score < best_score:
-                best_score = gen_score
-                best_program = gen_program
+        for width in widths:
+            memo_width = search.width = width
+            search.level = 0
+            for gen_program in (
+                generate_parallel_branches(a.transitions)
+                if jobs > 1 and bits > 0
+                else generate_branches(a.transitions, set(range(bits)), [None for b in range(bits)], {})
+            ):
+                gen_score = optimization_score(gen_program)
+                if gen_score < best_score:
+                    best_score = gen_score
+                    best_program = gen_program
+                    search.improved(best_score)
     except KeyboardInterrupt:
         print("Interrupted, printing best so far...", file=sys.stderr)
+    except BudgetExceeded:
+        print("Budget exhausted, printing best so far...", file=sys.stderr)
+    search.report("done")
     print(f"Final score {best_score}", file=sys.stderr)
+    print(
+        f"Micro steps: {best_program.cost} in total, {best_program.cost / best_program.states:g}"
+        f" on average, {best_program.worst} at worst",
+        file=sys.stderr,
+    )
     for instruction in best_program.instructions:
         print(instruction)
 
 
+class BudgetExceeded(Exception):
+    pass
+
+
+# How often progress is reported while optimizing, in seconds.
+PROGRESS_INTERVAL = 1.0
+
+
+class SearchProgress:
+    def __init__(self, output):
+        """Keeps count of the candidates tried by the optimizer, raising
+           BudgetExceeded once the time or candidate budget runs out, and
+           reports progress to stderr and, if output is given, as JSON
+           lines to that."""
+        self.output = output
+        self.started = time.monotonic()
+        self.next_check = 0
+        self.next_report = self.started + PROGRESS_INTERVAL
+        self.reporting = True
+        self.candidates = 0
+        self.best_score = None
+        self.width = 0
+        self.level = 0
+
+    def count(self, candidates=1):
+        self.candidates += candidates
+        if candidate_budget is not None and self.candidates >= candidate_budget:
+            raise BudgetExceeded()
+        if self.candidates < self.next_check:
+            return
+        # Looking at the clock for every candidate would slow things down.
+        self.next_check = self.candidates + 256
+        now = time.monotonic()
+        if time_budget is not None and now - self.started >= time_budget:
+            raise BudgetExceeded()
+        if self.reporting and now >= self.next_report:
+            self.next_report = now + PROGRESS_INTERVAL
+            print(f"Processed {self.candidates} candidates, best score {self.best_score}", file=sys.stderr)
+            self.report("progress")
+
+    def improved(self, score):
+        self.best_score = score
+        self.report("improved")
+
+    def report(self, event):
+        if self.output is None:
+            return
+        elapsed = time.monotonic() - self.started
+        self.output.write(json.dumps({
+            "event": event,
+            "elapsed": round(elapsed, 3),
+            "candidates": self.candidates,
+            "candidates_per_second": round(self.candidates / elapsed) if elapsed else None,
+            "best_score": self.best_score,
+            "width": self.width,
+            "level": self.level,
+        }) + "\n")
+        self.output.flush()
+
+
 def optimization_score(candidate):
+    """Returns the score to minimize, which starts with the micro steps taken
+       over all states or by the slowest one, depending on the objective."""
+    if objective == "worst":
+        return candidate.worst, candidate.cost, len(candidate.instructions)
     return candidate.cost, len(candidate.instructions)
 
 
@@ -539,36 +1661,294 @@ def shuffled_iter(input_set):
     return shuffled
 
 
-def generate_branches(transitions, remaining_bits, bit_values) -> Generator[Candidate, None, None]:
+# The number of candidates kept for each sub-table of the transition table.
+# Every pair of them is tried when two branches are combined, so this trades
+# the quality of the result against time. The search starts out keeping just
+# one and doubles memo_width up to MEMO_WIDTH. It's None for the exact
+# search, which keeps them all.
+MEMO_WIDTH = 16
+memo_width = MEMO_WIDTH
+search = None
+
+
+def generate_branches(transitions, remaining_bits, bit_values, memo, sub_table=None) -> Generator[Candidate, None, None]:
+    """Generates the best candidates for the part of the transition table
+       where the bits not in remaining_bits have the given values, at most
+       memo_width of them. They only depend on which bits remain and on the
+       following states of that sub-table, so they're memoized by those in
+       memo, which makes the search dynamic programming over sub-tables
+       rather than exhaustive (see below). The sub-table is computed from
+       the transitions unless it's given."""
     # number of results without SET reordering is exactly F(n) = n * F(n-1)^2; F(0) = 1 --> 1, 1, 2, 12, 576, 1658880
     # with SET reordering has upper bound def X(m, n=None): return X(m, m) if n is None else (factorial(m) if n==0 else n*(X(m, n-1)**2))
     # --> 1, 1, 32, 20155392, 6979147079584381377970176, 5670414999880734763050754456076553289728000000000000000000000000000000000
+    if sub_table is None:
+        sub_table = get_sub_table(transitions, remaining_bits, bit_values)
+    key = (frozenset(remaining_bits), sub_table)
+    if key in memo:
+        yield from memo[key]
+        return
+    best = []
     if remaining_bits == set():
-        next_state = [t for s, t, c in transitions if s == bit_values][0]
-        bits_to_set = {b for b in range(bits) if next_state[b]}
-        yield from generate_leaf_candidates(bits_to_set)
-    else:
-        for read_bit in shuffled_iter(remaining_bits):
-            sub_remaining_bits = remaining_bits - {read_bit}
-            left_bit_values = bit_values.copy()
-            left_bit_values[read_bit] = 0
-            right_bit_values = bit_values.copy()
-            right_bit_values[read_bit] = 1
-            for left_branch in generate_branches(transitions, sub_remaining_bits, left_bit_values):
-                for right_branch in generate_branches(transitions, sub_remaining_bits, right_bit_values):
-                    yield combine_branches(read_bit, left_branch, right_branch)
+        next_state = sub_table[0]
+        bits_to_set = {b for b in range(bits) if next_state >> b & 1}
+        # All orders of the SETs cost the same, so any memo_width of them
+        # are as good as the rest.
+        for candidate in islice(generate_leaf_candidates(bits_to_set), memo_width):
+            keep_candidate(best, candidate)
+        sort_candidates(best)
+        memo[key] = best
+        yield from best
+        return
+    # Branch and bound: the read bits that look cheapest are tried first, and
+    # any read bit or pair of branches whose lower bound is over the limit
+    # from score_limit() is skipped.
+    for split in get_splits(remaining_bits, bit_values, sub_table):
+        limit = score_limit(best)
+        if limit is not None and split[0] > limit:
+            break
+        combine_split(transitions, split, memo, best)
+    sort_candidates(best)
+    memo[key] = best
+    search.level = max(search.level, len(remaining_bits))
+    yield from best
+
+
+def greedy_candidate(transitions, remaining_bits, bit_values, sub_table=None) -> Candidate:
+    """Returns a single candidate for the same part of the transition table as
+       generate_branches(), always reading the bit whose split has the lowest
+       bound rather than searching. Once all the states of a sub-table have
+       the same following state, they share one order of its SETs."""
+    if sub_table is None:
+        sub_table = get_sub_table(transitions, remaining_bits, bit_values)
+    if len(set(sub_table)) == 1:
+        next_state = sub_table[0]
+        leaf = next(generate_leaf_candidates({b for b in range(bits) if next_state >> b & 1}))
+        return Candidate(
+            instructions=leaf.instructions,
+            states=len(sub_table),
+            cost=leaf.cost * len(sub_table),
+            worst=leaf.worst,
+        )
+    bound, read_bit, sub_remaining_bits, left_bit_values, right_bit_values, left_table, right_table = (
+        get_splits(remaining_bits, bit_values, sub_table)[0]
+    )
+    return combine_branches(
+        read_bit,
+        greedy_candidate(transitions, sub_remaining_bits, left_bit_values, left_table),
+        greedy_candidate(transitions, sub_remaining_bits, right_bit_values, right_table),
+    )
+
+
+def get_splits(remaining_bits, bit_values, sub_table):
+    """Returns (bound, read_bit, sub_remaining_bits, left_bit_values,
+       right_bit_values, left_table, right_table) for each way of splitting
+       the sub-table by reading one of the remaining bits, in order of the
+       lower bound on the cost of the result."""
+    ordered_bits = sorted(remaining_bits)
+    splits = []
+    for read_bit in shuffled_iter(remaining_bits):
+        sub_remaining_bits = remaining_bits - {read_bit}
+        left_bit_values = bit_values.copy()
+        left_bit_values[read_bit] = 0
+        right_bit_values = bit_values.copy()
+        right_bit_values[read_bit] = 1
+        # The read bit's value is this bit of an index into the sub-table.
+        mask = 1 << len(ordered_bits) - 1 - ordered_bits.index(read_bit)
+        left_table = tuple(s for i, s in enumerate(sub_table) if not i & mask)
+        right_table = tuple(s for i, s in enumerate(sub_table) if i & mask)
+        bound = score_bound((left_table, right_table), int(left_table != right_table))
+        splits.append((bound, read_bit, sub_remaining_bits, left_bit_values, right_bit_values, left_table, right_table))
+    splits.sort(key=lambda split: split[0])
+    return splits
+
+
+def combine_split(transitions, split, memo, best, best_cost=None):
+    """Adds the candidates made by combining the best branches on each side
+       of the given split to best, as with keep_candidate(). If given,
+       best_cost is a shared value holding the lowest first element of
+       optimization_score() found by any process, and nothing that can't
+       beat it is tried either."""
+    bound, read_bit, sub_remaining_bits, left_bit_values, right_bit_values, left_table, right_table = split
+    if best_cost is not None and bound > best_cost.value:
+        return
+    left_branches = list(generate_branches(transitions, sub_remaining_bits, left_bit_values, memo, left_table))
+    right_branches = list(generate_branches(transitions, sub_remaining_bits, right_bit_values, memo, right_table))
+    # Identical branches merge without a SKZ, which makes them cheaper than
+    # the bound below, so they're tried first.
+    right_set = set(right_branches)
+    for left_branch in left_branches:
+        if left_branch in right_set:
+            keep_candidate(best, combine_branches(read_bit, left_branch, left_branch))
+    for left_branch in left_branches:
+        for right_branch in right_branches:
+            limit = score_limit(best)
+            if best_cost is not None and (limit is None or best_cost.value < limit):
+                limit = best_cost.value
+            # Both lists are sorted by score, so nothing further along this
+            # row can do better.
+            if limit is not None and pair_bound(left_branch, right_branch) > limit:
+                break
+            if right_branch != left_branch:
+                keep_candidate(best, combine_branches(read_bit, left_branch, right_branch))
+
+
+def get_sub_table(transitions, remaining_bits, bit_values):
+    """Returns the following states of the part of the transition table where
+       the bits not in remaining_bits have the given values, ordered by the
+       values of the remaining bits."""
+    ordered_bits = sorted(remaining_bits)
+    base_state = state_to_int([v or 0 for v in bit_values])
+    return tuple(
+        transitions[base_state | sum(1 << b for b, v in zip(ordered_bits, values) if v)][1]
+        for values in product((0, 1), repeat=len(ordered_bits))
+    )
+
+
+def score_bound(sub_tables, skz_steps):
+    """Returns a lower bound on the first element of optimization_score() for
+       any candidate covering the given sub-tables, where every state first
+       runs skz_steps SKZs. Then each state has to run its SETs and the END,
+       plus at least one more SKZ unless all the states of its sub-table
+       have the same following state."""
+    steps = [
+        bin(next_state).count("1") + 1 + skz_steps + (len(set(sub_table)) > 1)
+        for sub_table in sub_tables
+        for next_state in sub_table
+    ]
+    return max(steps) if objective == "worst" else sum(steps)
+
+
+def pair_bound(left_branch, right_branch):
+    """Returns a lower bound on the first element of optimization_score() for
+       combining two different branches, which adds a SKZ to every state."""
+    if objective == "worst":
+        return max(left_branch.worst, right_branch.worst) + 1
+    return left_branch.cost + right_branch.cost + left_branch.states + right_branch.states
+
+
+def score_limit(best):
+    """Returns the first element of optimization_score() that a candidate for
+       the sub-table with the given best candidates mustn't exceed to be
+       kept, or None if there's no limit yet. The beam search is limited by
+       the worst candidate once it has memo_width of them. The exact search
+       is limited by the best program found so far, since a program never
+       costs less than any of its subtrees."""
+    if memo_width is None:
+        return search.best_score[0]
+    if len(best) == memo_width:
+        return optimization_score(best[-1])[0]
+    return None
+
+
+def keep_candidate(best, candidate):
+    """Adds the candidate to best, a list sorted by optimization_score(),
+       unless it's already there, then keeps only the first memo_width. The
+       exact search keeps too many candidates to sort each time, so it just
+       appends them, to be sorted by sort_candidates() once they're all in."""
+    search.count()
+    if memo_width is None:
+        if optimization_score(candidate)[0] <= search.best_score[0]:
+            best.append(candidate)
+        return
+    if len(best) == memo_width and optimization_score(candidate) >= optimization_score(best[-1]):
+        return
+    if any(kept.instructions == candidate.instructions for kept in best):
+        return
+    best.append(candidate)
+    best.sort(key=optimization_score)
+    del best[memo_width:]
+
+
+def sort_candidates(best):
+    """Sorts the candidates added to best by keep_candidate() and drops any
+       duplicates, which is only needed after the exact search."""
+    if memo_width is None:
+        best[:] = sorted(dict.fromkeys(best), key=optimization_score)
+
+
+optimize_transitions = None
+optimize_best_cost = None
+optimize_memo = None
+
+
+def init_optimize_worker(transitions, memo, best_cost=None):
+    global optimize_transitions, optimize_memo, optimize_best_cost
+    # Only the parent process reacts to Ctrl-C, by printing the best so far,
+    # and reports progress, adding up the counts returned by the workers.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    search.reporting = False
+    optimize_transitions = transitions
+    optimize_memo = memo
+    optimize_best_cost = best_cost
+
+
+def optimize_sub_table(task):
+    remaining_bits, bit_values, sub_table = task
+    counted = search.candidates
+    candidates = list(generate_branches(optimize_transitions, remaining_bits, bit_values, optimize_memo, sub_table))
+    return (frozenset(remaining_bits), sub_table), candidates, search.candidates - counted
+
+
+def optimize_split(split):
+    counted = search.candidates
+    best = []
+    combine_split(optimize_transitions, split, optimize_memo, best, optimize_best_cost)
+    sort_candidates(best)
+    if best:
+        with optimize_best_cost.get_lock():
+            optimize_best_cost.value = min(optimize_best_cost.value, optimization_score(best[0])[0])
+    return best, search.candidates - counted
+
+
+def generate_parallel_branches(transitions) -> Generator[Candidate, None, None]:
+    """Like generate_branches() for the whole transition table, but spread
+       over worker processes. The memo is filled in one level at a time,
+       from the sub-tables with no bits left to read upwards, with the
+       distinct sub-tables of each level handed out to workers that inherit
+       the levels below. Then the read bits at the top of the tree are handed
+       out, and those workers share the lowest cost found so far, starting
+       from the program to beat, to prune against."""
+    context = multiprocessing.get_context("fork")
+    memo = {}
+    for level in range(bits):
+        tasks = {}
+        for remaining in combinations(range(bits), level):
+            remaining_bits = set(remaining)
+            fixed_bits = [b for b in range(bits) if b not in remaining_bits]
+            for fixed_values in product((0, 1), repeat=len(fixed_bits)):
+                bit_values = [None for b in range(bits)]
+                for b, v in zip(fixed_bits, fixed_values):
+                    bit_values[b] = v
+                sub_table = get_sub_table(transitions, remaining_bits, bit_values)
+                tasks.setdefault((frozenset(remaining_bits), sub_table), (remaining_bits, bit_values, sub_table))
+        with context.Pool(jobs, init_optimize_worker, (transitions, memo)) as pool:
+            for key, candidates, count in pool.imap_unordered(optimize_sub_table, tasks.values(), chunksize=16):
+                memo[key] = candidates
+                search.count(count)
+        search.level = level
+    remaining_bits = set(range(bits))
+    bit_values = [None for b in range(bits)]
+    splits = get_splits(remaining_bits, bit_values, get_sub_table(transitions, remaining_bits, bit_values))
+    best_cost = context.Value("q", search.best_score[0])
+    with context.Pool(jobs, init_optimize_worker, (transitions, memo, best_cost)) as pool:
+        for candidates, count in pool.imap_unordered(optimize_split, splits):
+            search.count(count)
+            yield from candidates
+    search.level = bits
 
 
 def generate_leaf_candidates(bits_to_set) -> Generator[Candidate, None, None]:
     if bits_to_set == set():
-        yield Candidate(instructions=("END",), states=1, cost=1)
+        yield Candidate(instructions=("END",), states=1, cost=1, worst=1)
     else:
         for bit in shuffled_iter(bits_to_set):
             for sub_candidate in generate_leaf_candidates(bits_to_set - {bit}):
                 yield Candidate(
                     instructions=(f"SET #{bit}",) + sub_candidate.instructions,
                     states=1,
-                    cost=sub_candidate.cost + 1
+                    cost=sub_candidate.cost + 1,
+                    worst=sub_candidate.worst + 1,
                 )
 
 
@@ -577,7 +1957,8 @@ def combine_branches(read_bit: int, left_branch: Candidate, right_branch: Candid
         return Candidate(
             instructions=left_branch.instructions,
             states=left_branch.states + right_branch.states,
-            cost=left_branch.cost + right_branch.cost
+            cost=left_branch.cost + right_branch.cost,
+            worst=max(left_branch.worst, right_branch.worst),
         )
 
     result = []
@@ -593,7 +1974,10 @@ def combine_branches(read_bit: int, left_branch: Candidate, right_branch: Candid
     right_full = right_sets + right_rest
 
     result.append(f"SKZ #{read_bit}")
+    # Every state runs the SKZ, and those going right run the JMP if any.
     cost = left_branch.cost + right_branch.cost + left_branch.states + right_branch.states
+    left_worst = left_branch.worst + 1
+    right_worst = right_branch.worst + 1
 
     if right_full == ["END"]:
         result.append("END")
@@ -602,6 +1986,7 @@ def combine_branches(read_bit: int, left_branch: Candidate, right_branch: Candid
         result.extend(right_full)
     else:
         cost += right_branch.states
+        right_worst += 1
         offset = min(
             (o for o in range(1, len(left_full)-len(right_full)+1) if right_full == left_full[o:]),
             default=None
@@ -613,7 +1998,12 @@ def combine_branches(read_bit: int, left_branch: Candidate, right_branch: Candid
             result.append(f"JMP +{len(left_full)+1}")
             result.extend(left_full)
             result.extend(right_full)
-    return Candidate(instructions=tuple(result), states=left_branch.states+right_branch.states, cost=cost)
+    return Candidate(
+        instructions=tuple(result),
+        states=left_branch.states+right_branch.states,
+        cost=cost,
+        worst=max(left_worst, right_worst),
+    )
 
 
 def extract_set_instructions(instructions):
@@ -629,19 +2019,22 @@ def extract_set_instructions(instructions):
     return set_instructions, rest_instructions
 
 
-if command == "run":
-    run_from(starting_state)
-elif command == "analyze":
-    analyze()
-elif command == "diagram":
-    diagram()
-elif command == "test":
-    if test_stage == "prep":
-        test_prep()
+# The command is only run when this is the main script, so that the tests can
+# load the functions for a given program without running it.
+if __name__ == "__main__":
+    if command == "run":
+        run_from(starting_state)
+    elif command == "analyze":
+        analyze()
+    elif command == "diagram":
+        diagram()
+    elif command == "test":
+        if test_stage == "prep":
+            test_prep()
+        else:
+            test_check()
+    elif command == "optimize":
+        generate_optimized_program()
     else:
-        test_check()
-elif command == "optimize":
-    generate_optimized_program()
-else:
-    assert command == "micro"
-    micro_analyze()
+        assert command == "micro"
+        micro_analyze()
@@ -16,13 +16,25 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import importlib.util
 import numpy
+import os
 import pyphi
 from enum import Enum
 from fractions import Fraction as F
 from itertools import chain, combinations
 from typing import Generator, Iterable
 
+# The phi store shared with run.py lives in the directory above, and is loaded
+# from there by file name so that this works from any working directory.
+phistore_spec = importlib.util.spec_from_file_location(
+    "phistore", os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "phistore.py")
+)
+phistore = importlib.util.module_from_spec(phistore_spec)
+phistore_spec.loader.exec_module(phistore)
+PhiStore = phistore.PhiStore
+network_key = phistore.network_key
+
 class Reg(Enum):
     A = 0
     B = 1
@@ -193,27 +205,38 @@ def macro_bit(sigma: tuple[
 
 tpm_to_network = {}
 tpm_to_phis = {}
+phi_store = None
 
 def calc_phis(tpm):
+    global phi_store
     if tpm in tpm_to_phis:
         return tpm_to_phis[tpm]
 
-    if tpm in tpm_to_network:
-        network = tpm_to_network[tpm]
-    else:
-        network = pyphi.Network(numpy.array([
-            [float(cell) for cell in row]
-            for row in tpm
-        ]))
-        tpm_to_network[tpm] = network
+    # Phi values are also kept in the phi store shared with run.py, so they
+    # survive from one run to the next.
+    if phi_store is None:
+        phi_store = PhiStore()
+    tpm_array = numpy.array([
+        [float(cell) for cell in row]
+        for row in tpm
+    ])
+    key = network_key(tpm_array)
 
     phis = []
     for state in ((0, 0), (1, 0), (0, 1), (1, 1)):
-        try:
-            phi = round(pyphi.compute.phi(pyphi.Subsystem(network, state)), 4)
-        except pyphi.exceptions.StateUnreachableError:
-            phi = -1
-        phis.append(phi)
+        found, phi = phi_store.get(key, state)
+        if not found:
+            if tpm in tpm_to_network:
+                network = tpm_to_network[tpm]
+            else:
+                network = pyphi.Network(tpm_array)
+                tpm_to_network[tpm] = network
+            try:
+                phi = pyphi.compute.phi(pyphi.Subsystem(network, state))
+            except pyphi.exceptions.StateUnreachableError:
+                phi = None
+            phi_store.put(key, state, phi)
+        phis.append(-1 if phi is None else round(phi, 4))
     phis = tuple(phis)
     tpm_to_phis[tpm] = phis
     return phis
@@ -0,0 +1,58 @@
+# Justin's IIT Thesis - Causal Snapshotting Analyzer
+# Copyright 2022-2023 by Justin T. Sampson
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import unittest
+
+from itertools import islice
+
+try:
+    import snap
+except ImportError:
+    snap = None
+
+
+def gen_tpms(prog):
+    for delta in snap.gen_delta():
+        for epsilon in snap.gen_epsilon(delta, prog.I_options):
+            for sigma in snap.gen_sigma(delta):
+                yield snap.calc_tpm(prog, epsilon, sigma)
+
+
+@unittest.skipIf(snap is None, "PyPhi is not installed")
+class PhiStoreTests(unittest.TestCase):
+    def calc_all_phis(self, tpms, path):
+        """Returns the phis of each of the given TPMs as calc_phis() gives
+           them with the store at the given path and nothing in memory."""
+        snap.tpm_to_network.clear()
+        snap.tpm_to_phis.clear()
+        snap.phi_store = snap.PhiStore(path)
+        return [snap.calc_phis(tpm) for tpm in tpms]
+
+    def test_storedPhisMatchComputed(self):
+        # Some of the first TPMs have an int 0 for phi and some a float 0.0,
+        # which print differently, so they're compared by repr.
+        tpms = list(dict.fromkeys(islice(gen_tpms(snap.prog1), 40)))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "phi.sqlite")
+            computed = self.calc_all_phis(tpms, path)
+            stored = self.calc_all_phis(tpms, path)
+        self.assertEqual(repr(stored), repr(computed))
+
+
+if __name__ == '__main__':
+    unittest.main()
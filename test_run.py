@@ -0,0 +1,378 @@
+# Justin's IIT Thesis - Toy Computer Emulator
+# Copyright 2022-2023 by Justin T. Sampson
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import importlib.util
+import io
+import json
+import os
+import re
+import runpy
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def load(program, *options):
+    """Returns the globals of run.py for the given sample program and
+       options, without running a command."""
+    argv = sys.argv
+    sys.argv = ["run.py", os.path.join(DIRECTORY, program), "--cache", "off", *options]
+    try:
+        run = runpy.run_path(os.path.join(DIRECTORY, "run.py"))
+    finally:
+        sys.argv = argv
+    run["program_file"].close()
+    return run
+
+
+def run_process(program, *arguments, **options):
+    """Runs run.py for the given sample program and arguments as its own
+       process, passing any options on to subprocess.run(), and returns the
+       completed process with its output and errors."""
+    return subprocess.run(
+        [sys.executable, os.path.join(DIRECTORY, "run.py"), program, "--cache", "off", *arguments],
+        cwd=DIRECTORY,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        **options,
+    )
+
+
+def run_command(program, *arguments, **options):
+    """Returns the output of run.py for the given sample program and
+       arguments, run as its own process, which has to succeed."""
+    return run_process(program, *arguments, check=True, universal_newlines=True, **options).stdout
+
+
+def optimize(program, *options):
+    """Returns the program printed by the optimize command for the given
+       sample program and options, along with the total and worst micro
+       steps it reports."""
+    result = run_process(program, "optimize", *options, check=True, universal_newlines=True)
+    match = re.search("Micro steps: ([0-9]+) in total, .* ([0-9]+) at worst", result.stderr)
+    return result.stdout, int(match.group(1)), int(match.group(2))
+
+
+def analyze(run):
+    analyzer = run["Analyzer"]()
+    analyzer.perform_analysis()
+    return analyzer
+
+
+class OrbitTests(unittest.TestCase):
+    def find_orbits(self, program):
+        run = load(program)
+        analyzer = analyze(run)
+        following = numpy.array([t for s, t, c in analyzer.transitions], dtype=numpy.uint64)
+        return run["find_orbits"](following, analyzer.connectivity)
+
+    def test_xor3(self):
+        # Every permutation of the bits is an automorphism, so the orbits
+        # are the states with the same number of bits set.
+        orbits, automorphism_count = self.find_orbits("xor3.txt")
+        self.assertEqual(automorphism_count, 6)
+        self.assertEqual(orbits.tolist(), [0, 1, 1, 3, 1, 3, 3, 7])
+
+    def test_pqrpqr(self):
+        # The only automorphisms are the identity and swapping the two
+        # copies of pqr.
+        orbits, automorphism_count = self.find_orbits("pqrpqr.txt")
+        self.assertEqual(automorphism_count, 2)
+        self.assertEqual(orbits.tolist(), [min(s, s >> 3 | (s & 7) << 3) for s in range(64)])
+
+    def test_pqr(self):
+        orbits, automorphism_count = self.find_orbits("pqr.txt")
+        self.assertEqual(automorphism_count, 1)
+        self.assertEqual(orbits.tolist(), list(range(8)))
+
+
+class FixtureTests(unittest.TestCase):
+    def test_roundTrip(self):
+        run = load("pqr.txt")
+        for width in (1, 2, 8):
+            for following_state, count in [
+                (0, 1),
+                (1, 7),
+                (2**(8 * width) - 1, 255),
+                (None, 3),
+                (None, 2**15 - 1),
+            ]:
+                record = run["pack_transition"](following_state, count, width)
+                self.assertEqual(len(record), width + 2)
+                self.assertEqual(run["unpack_transition"](record, width), (following_state, count))
+
+    def test_jsonArray(self):
+        run = load("pqr.txt")
+        gen_json_array = run["gen_json_array"]
+        rows = [[[0, 1], None, 10], [[1, 1], [1, 0], 12345], [[0, 0], [0, 0], 7]]
+        for text in (
+            json.dumps(rows),
+            json.dumps(rows, indent=2),
+            "[\n" + ",\n".join("  " + json.dumps(row) for row in rows) + "\n]\n",
+        ):
+            for chunk_size in (1, 2, 3, 7, 2**16):
+                with self.subTest(text=text, chunk_size=chunk_size):
+                    self.assertEqual(list(gen_json_array(io.StringIO(text), chunk_size)), rows)
+        self.assertEqual(list(gen_json_array(io.StringIO(" [ ] "), 1)), [])
+        self.assertEqual(list(gen_json_array(io.StringIO("[1, 23,456]"), 2)), [1, 23, 456])
+        for text in ("", "{}", "[1, 2", "[1 2]", "[1,, 2]", "[[1]"):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    list(gen_json_array(io.StringIO(text), 2))
+
+    def test_checkJson(self):
+        fixture = run_command("pqr.txt", "test", "prep")
+        compact = json.dumps(json.loads(fixture))
+        for program in ("pqr.txt", "tree.txt"):
+            for text in (fixture, compact):
+                with self.subTest(program=program, compact=text is compact):
+                    self.assertEqual(run_command(program, "test", "check", input=text), "Test passed!\n")
+
+    def test_checkJsonMismatch(self):
+        result = run_process(
+            "xor3.txt", "test", "check",
+            input=run_command("pqr.txt", "test", "prep"),
+            universal_newlines=True,
+        )
+        self.assertEqual(result.returncode, 1)
+        self.assertEqual(result.stdout.splitlines(), [
+            "Test failed. Mismatched transitions:",
+            "100 -> 001 vs. 011",
+            "110 -> 100 vs. 110",
+            "101 -> 111 vs. 101",
+            "011 -> 111 vs. 011",
+            "111 -> 110 vs. 000",
+        ])
+
+    def check_fixture(self, program, fixture, piped):
+        """Returns the completed test check of the given program against the
+           given binary fixture, read from a regular file (and so memory-
+           mapped) or else from a pipe."""
+        if piped:
+            return run_process(program, "test", "check", input=fixture)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "fixture.bin")
+            with open(path, "wb") as f:
+                f.write(fixture)
+            with open(path, "rb") as f:
+                return run_process(program, "test", "check", stdin=f)
+
+    def test_checkBinary(self):
+        fixture = run_process("pqr.txt", "test", "prep", "--format", "bin", check=True).stdout
+        for piped in (False, True):
+            with self.subTest(piped=piped):
+                result = self.check_fixture("pqr.txt", fixture, piped)
+                self.assertEqual((result.returncode, result.stdout), (0, b"Test passed!\n"))
+                result = self.check_fixture("tree.txt", fixture, piped)
+                self.assertEqual((result.returncode, result.stdout), (0, b"Test passed!\n"))
+                result = self.check_fixture("xor3.txt", fixture, piped)
+                self.assertEqual(result.returncode, 1)
+                self.assertEqual(result.stdout.decode().splitlines(), [
+                    "Test failed. Mismatched transitions:",
+                    "100 -> 001 vs. 011",
+                    "110 -> 100 vs. 110",
+                    "101 -> 111 vs. 101",
+                    "011 -> 111 vs. 011",
+                    "111 -> 110 vs. 000",
+                ])
+                result = self.check_fixture("counter.txt", fixture, piped)
+                self.assertEqual(result.returncode, 1)
+                self.assertEqual(result.stderr, b"Expected 8 transitions but actually 16.\n")
+                # A fixture missing its last record (3 bytes for 3 bits) is too short.
+                result = self.check_fixture("pqr.txt", fixture[:-3], piped)
+                self.assertEqual(result.returncode, 1)
+                self.assertEqual(result.stderr, b"Expected 7 transitions but actually 8.\n")
+
+    def test_cachedAnalysisMatches(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            computed = analyze(load("counter.txt", "--cache", cache_dir))
+            cached = analyze(load("counter.txt", "--cache", cache_dir))
+            self.assertEqual(cached.transitions, computed.transitions)
+            self.assertEqual(cached.connectivity, computed.connectivity)
+            self.assertEqual(cached.bb_candidates, computed.bb_candidates)
+
+
+class EngineTests(unittest.TestCase):
+    def test_numpyMatchesPython(self):
+        for program in ("pqr.txt", "counter.txt", "tree.txt", "unrolled-short-circuit.txt"):
+            with self.subTest(program=program):
+                expected = analyze(load(program, "--engine", "python"))
+                actual = analyze(load(program, "--engine", "numpy"))
+                self.assertEqual(actual.transitions, expected.transitions)
+                self.assertEqual(actual.connectivity, expected.connectivity)
+                self.assertEqual(actual.bb_candidates, expected.bb_candidates)
+
+    def test_shardsMatchSingleProcess(self):
+        # The functions of a loaded run.py can't be sent to worker processes,
+        # so the sharded analysis is compared by its printed output, which
+        # includes the transitions, connectivity and black-box candidates.
+        for program in ("pqr.txt", "counter.txt", "tree.txt", "unrolled-short-circuit.txt"):
+            for engine in ("python", "numpy"):
+                with self.subTest(program=program, engine=engine):
+                    self.assertEqual(
+                        run_command(program, "--engine", engine, "--jobs", "2"),
+                        run_command(program, "--engine", "python"),
+                    )
+
+
+class SymbolicTests(unittest.TestCase):
+    def test_transitionsMatchEnumeration(self):
+        for program in ("pqr.txt", "counter.txt", "tree.txt", "unrolled-short-circuit.txt"):
+            enumerated = analyze(load(program, "--engine", "python"))
+            symbolic = analyze(load(program, "--engine", "symbolic"))
+            self.assertEqual(symbolic.transitions, enumerated.transitions)
+            self.assertEqual(symbolic.connectivity, enumerated.connectivity)
+
+    def test_mergeCubes(self):
+        run = load("pqr.txt")
+        merge_cubes = run["merge_cubes"]
+        self.assertEqual(merge_cubes([]), [])
+        # A[0] & ~A[1] | A[0] & A[1] | ~A[0] & A[1] == A[0] | A[1]
+        self.assertEqual(merge_cubes([(3, 1), (3, 3), (3, 2)]), [(1, 1), (2, 2)])
+        # Cubes with different care masks: A[0] | ~A[0] & A[1] == A[0] | A[1]
+        self.assertEqual(merge_cubes([(1, 1), (3, 2)]), [(1, 1), (2, 2)])
+        self.assertEqual(merge_cubes([(1, 0), (1, 1)]), [(0, 0)])
+
+
+@unittest.skipUnless(importlib.util.find_spec("pyphi"), "PyPhi is not installed")
+class PhiTests(unittest.TestCase):
+    def test_jobsMatchSingleProcess(self):
+        for arguments in (("pqr.txt",), ("not.txt", "micro", "--range", "0:2")):
+            self.assertEqual(
+                run_command(*arguments, "--jobs", "2", "phi"),
+                run_command(*arguments, "--jobs", "1", "phi"),
+            )
+
+
+class OptimizeTests(unittest.TestCase):
+    def check_program(self, program, optimized, cost, worst):
+        """Checks that the optimized program has the same transition table
+           as the sample program and takes the reported micro steps."""
+        expected = analyze(load(program))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "optimized.txt")
+            with open(path, "w") as f:
+                f.write(optimized)
+            actual = analyze(load(path))
+        self.assertEqual([t for s, t, c in actual.transitions], [t for s, t, c in expected.transitions])
+        self.assertEqual(sum(c for s, t, c in actual.transitions), cost)
+        self.assertEqual(max(c for s, t, c in actual.transitions), worst)
+
+    def score(self, objective, optimized, cost, worst):
+        """Returns the optimization score of the given optimize output."""
+        instruction_count = len(optimized.splitlines())
+        if objective == "worst":
+            return worst, cost, instruction_count
+        return cost, instruction_count
+
+    def test_reportedStepsMatchAnalysis(self):
+        for program in ("pqr.txt", "xor3.txt", "counter.txt", "tree.txt"):
+            for objective in ("total", "worst"):
+                with self.subTest(program=program, objective=objective):
+                    self.check_program(program, *optimize(program, "--objective", objective))
+
+    def test_exactMatchesBeam(self):
+        for program in ("pqr.txt", "counter.txt"):
+            for objective in ("total", "worst"):
+                with self.subTest(program=program, objective=objective):
+                    exact = optimize(program, "--objective", objective, "--search", "exact")
+                    beam = optimize(program, "--objective", objective)
+                    self.check_program(program, *exact)
+                    self.assertEqual(self.score(objective, *exact), self.score(objective, *beam))
+
+    def test_candidateBudget(self):
+        self.check_program("counter.txt", *optimize("counter.txt", "--candidate-budget", "1"))
+
+
+class MicroTests(unittest.TestCase):
+    def reference_micro_step(self, run, abi):
+        """Returns the following micro state of the given one, computed
+           directly from the program's instruction tuples."""
+        bits = run["bits"]
+        a = abi & run["state_mask"]
+        b = abi >> bits & run["state_mask"]
+        i = abi >> 2 * bits
+        operation, operand = run["program"][i]
+        if operation == "JMP" and operand == 0:
+            a, b, next_i = b, 0, 0
+        elif operation == "JMP":
+            next_i = i + operand
+        elif operation == "SKZ":
+            next_i = i + (1 if a >> operand & 1 else 2)
+        else:
+            b = b | 1 << operand if operation == "SET" else b & ~(1 << operand)
+            next_i = i + 1
+        # The registers are updated even when crashing, but I stays put.
+        if next_i > 255:
+            next_i = i
+        return a | b << bits | next_i << 2 * bits
+
+    def test_blocksMatchReference(self):
+        # Only a jump past address 255 crashes, so the program is padded out
+        # to end with a SKZ that crashes when A is zero and a JMP that always
+        # does.
+        lines = ["SKZ #0", "SET #1", "CLR #0", "JMP +2", "SET #0", "END"]
+        lines += ["NOP"] * (254 - len(lines)) + ["SKZ #1", "JMP +63"]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "micro.txt")
+            with open(path, "w") as f:
+                f.write("\n".join(lines) + "\n")
+            run = load(path)
+        i_bits = int.bit_length(run["program_length"] - 1)
+        expected = [self.reference_micro_step(run, abi) for abi in range(2**(2 * run["bits"] + i_bits))]
+        for vectorized in (False, True):
+            with self.subTest(vectorized=vectorized):
+                actual = []
+                for i, following in run["gen_micro_blocks"](i_bits, vectorized):
+                    actual.extend(following.tolist() if vectorized else following)
+                self.assertEqual(actual, expected)
+
+
+    def test_exceededProgramLength(self):
+        # The SKZ at the last address can skip past the two addresses that I
+        # can hold, which is reported before anything is printed.
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "micro.txt")
+            with open(path, "w") as f:
+                f.write("SET #0\nSKZ #0\n")
+            result = run_process(path, "micro", universal_newlines=True)
+        self.assertEqual(result.returncode, 1)
+        self.assertEqual(result.stdout, "")
+        self.assertEqual(result.stderr, "I exceeded given program length.\n")
+
+
+class JournalTests(unittest.TestCase):
+    def test_readJournal(self):
+        run = load("pqr.txt")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "journal")
+            with open(path, "w") as f:
+                f.write(json.dumps({"network": "a", "state": "000", "phi": 0.5}) + "\n")
+                f.write(json.dumps({"network": "b", "state": "001", "phi": 1.5}) + "\n")
+                f.write(json.dumps({"network": "a", "state": "010", "phi": None}) + "\n")
+                f.write('{"network": "a", "state": "011", "ph')
+            self.assertEqual(run["read_journal"](path, "a"), {"000": 0.5, "010": None})
+            self.assertEqual(run["read_journal"](path, "c"), {})
+            self.assertEqual(run["read_journal"](os.path.join(directory, "missing"), "a"), {})
+
+
+if __name__ == '__main__':
+    unittest.main()